@@ -0,0 +1,248 @@
+import os, sys, json, random, optparse, timeit, collections, itertools
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+from pygame.locals import *
+
+from mothership import Game, TitleScreen, Explosion, Mothership, RandomPilot, SIM_STEP, RESOLUTION
+
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# p95 budgets per subsystem, in milliseconds, out of a 33ms frame
+BUDGETS = {
+	'frame': 33.3,
+	'update': 12.0,
+	'render': 16.0,
+	'flip': 8.0,
+	'starfield': 4.0,
+	'missiles': 8.0,
+	'explosions': 8.0,
+	'title': 16.0,
+}
+
+class Scenario(object):
+
+	name = 'scenario'
+	frames = 300
+
+	def setup(self, game):
+		game.main_loop_done = False
+		game.setup_game(1)
+		game.lives = 1000000
+		self.pilot = RandomPilot(1)
+
+	def before_frame(self, game, frame):
+		game.player.invincible = SIM_STEP * 2
+		self.pilot(game, frame)
+
+	def spawn_mothership(self, game):
+		for object in itertools.chain(game.layers['mothership'], game.objects_to_add):
+			if isinstance(object, Mothership): return object
+		boss = Mothership(game)
+		game.add_object(boss)
+		return boss
+
+class BossScenario(Scenario):
+
+	name = 'boss'
+
+	def setup(self, game):
+		Scenario.setup(self, game)
+		game.difficulty = 10.5
+		game.difficulty_factor = 1.1
+		self.spawn_mothership(game)
+
+class MissileScenario(Scenario):
+
+	name = 'missiles'
+	count = 500
+	player_fires = True
+
+	def before_frame(self, game, frame):
+		Scenario.before_frame(self, game, frame)
+		boss = self.spawn_mothership(game)
+
+		live = len(game.projectiles) + len(game.projectiles.pending)
+		for i in xrange(self.count - live):
+			owner, direction = (boss, 1) if i % 2 or not self.player_fires else (game.player, -1)
+			pos = (random.randint(0, RESOLUTION[0]), random.randint(0, RESOLUTION[1]))
+			game.projectiles.spawn(owner, 0.1, 1.02, direction, pos)
+
+class BulletHellScenario(MissileScenario):
+
+	# a screen full of the boss's missiles; with player missiles mixed in at
+	# this density the frame would be all explosions
+	name = 'bullethell'
+	count = 5000
+	player_fires = False
+
+class ExplosionScenario(Scenario):
+
+	name = 'explosions'
+	count = 50
+
+	def before_frame(self, game, frame):
+		Scenario.before_frame(self, game, frame)
+
+		live = sum(1 for object in itertools.chain(game.objects, game.objects_to_add) if isinstance(object, Explosion))
+		for i in xrange(self.count - live):
+			pos = (random.randint(0, RESOLUTION[0]), random.randint(0, RESOLUTION[1]))
+			game.add_object(Explosion.spawn(game, pos, random.randint(1, 30)))
+
+class TitleScenario(Scenario):
+
+	name = 'title'
+	frames = 1000
+
+	def setup(self, game):
+		self.title = TitleScreen(game, 0)
+
+	def run(self, bench):
+		for frame in xrange(self.frames):
+			with bench.timer('title'):
+				self.title.handle_input()
+				self.title.render()
+			self.title.alpha = min(255, self.title.alpha + 1)
+			bench.end_frame()
+
+SCENARIOS = [BossScenario, MissileScenario, BulletHellScenario, ExplosionScenario, TitleScenario]
+
+class Timer(object):
+
+	def __init__(self, bench, key):
+		self.bench = bench
+		self.key = key
+
+	def __enter__(self): self.start = timeit.default_timer()
+	def __exit__(self, *args): self.bench.current[self.key] += timeit.default_timer() - self.start
+
+class Benchmark(object):
+
+	def __init__(self, game):
+		self.game = game
+		self.current = collections.defaultdict(float)
+		self.samples = collections.defaultdict(list)
+		self.patched = []
+
+	def timer(self, key): return Timer(self, key)
+
+	def instrument(self, cls, method, key):
+		original = cls.__dict__[method]
+		bench = self
+		def timed(*args, **kwargs):
+			start = timeit.default_timer()
+			try: return original(*args, **kwargs)
+			finally: bench.current[key] += timeit.default_timer() - start
+		setattr(cls, method, timed)
+		self.patched.append((cls, method, original))
+
+	def restore(self):
+		for cls, method, original in reversed(self.patched): setattr(cls, method, original)
+		self.patched = []
+
+	def end_frame(self):
+		for key, seconds in self.current.items(): self.samples[key].append(seconds * 1000.0)
+		self.current.clear()
+
+	def run_scenario(self, scenario):
+		game = self.game
+		random.seed(1)
+		scenario.setup(game)
+
+		if hasattr(scenario, 'run'): return scenario.run(self)
+
+		starfield = type(game.starfield)
+		self.instrument(starfield, 'update', 'starfield')
+		self.instrument(starfield, 'render', 'starfield')
+		self.instrument(type(game.projectiles), 'update', 'missiles')
+		self.instrument(Explosion, 'render', 'explosions')
+
+		try:
+			for frame in xrange(scenario.frames):
+				with self.timer('frame'):
+					scenario.before_frame(game, frame)
+					with self.timer('update'): game.step(SIM_STEP)
+					with self.timer('render'):
+						game.screen.fill((0,0,0))
+						game.render()
+					with self.timer('flip'): game.display.present()
+				self.end_frame()
+		finally:
+			self.restore()
+
+	def report(self):
+		results = {}
+		for key, samples in self.samples.items():
+			samples = sorted(samples)
+			n = len(samples)
+			results[key] = {
+				'mean': sum(samples) / n,
+				'p95': samples[min(n-1, int(n * 0.95))],
+				'p99': samples[min(n-1, int(n * 0.99))],
+			}
+		return results
+
+def run_benchmarks(names=None):
+	game = Game(headless=True)
+	results = {}
+	for cls in SCENARIOS:
+		if names and cls.name not in names: continue
+		bench = Benchmark(game)
+		bench.run_scenario(cls())
+		results[cls.name] = bench.report()
+	return results
+
+def check(results, baseline, tolerance, min_delta):
+	regressions = []
+	over_budget = []
+	for scenario, subsystems in sorted(results.items()):
+		for key, stats in sorted(subsystems.items()):
+			budget = BUDGETS.get(key)
+			if budget is not None and stats['p95'] > budget:
+				over_budget.append("%s/%s: p95 %.2fms over budget of %.2fms" % (scenario, key, stats['p95'], budget))
+
+			base = baseline.get(scenario, {}).get(key)
+			if base is None: continue
+			for stat in ('mean', 'p95'):
+				if stats[stat] > base[stat] * (1 + tolerance) and stats[stat] - base[stat] > min_delta:
+					regressions.append("%s/%s: %s %.2fms regressed from %.2fms" % (scenario, key, stat, stats[stat], base[stat]))
+	return regressions, over_budget
+
+def print_results(results):
+	for scenario, subsystems in sorted(results.items()):
+		print(scenario)
+		for key, stats in sorted(subsystems.items()):
+			print("  %-12s mean %7.3fms  p95 %7.3fms  p99 %7.3fms" % (key, stats['mean'], stats['p95'], stats['p99']))
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage="%prog [options] [scenario...]")
+	parser.add_option("--baseline", default=BASELINE_FILE, help="baseline results to compare against")
+	parser.add_option("--save-baseline", action="store_true", default=False, help="store these results as the new baseline")
+	parser.add_option("--tolerance", type="float", default=0.2, help="allowed slowdown against the baseline (0.2 = 20%)")
+	parser.add_option("--min-delta", type="float", default=0.1, help="ignore regressions smaller than this many milliseconds")
+	parser.add_option("--enforce-budgets", action="store_true", default=False, help="also fail when a subsystem's p95 is over its budget")
+	options, args = parser.parse_args()
+
+	results = run_benchmarks(args)
+	print_results(results)
+
+	if options.save_baseline:
+		f = open(options.baseline, 'w')
+		json.dump(results, f, indent=1, sort_keys=True)
+		f.close()
+		sys.exit(0)
+
+	# timings only compare on the machine that recorded them, so the baseline
+	# is local; without one nothing could be caught
+	if not os.path.exists(options.baseline):
+		print("FAIL no baseline at %s, record one on this machine with --save-baseline" % options.baseline)
+		sys.exit(1)
+	f = open(options.baseline, 'r')
+	baseline = json.load(f)
+	f.close()
+
+	regressions, over_budget = check(results, baseline, options.tolerance, options.min_delta)
+	for failure in over_budget: print(("FAIL " if options.enforce_budgets else "OVER BUDGET ") + failure)
+	for failure in regressions: print("FAIL " + failure)
+	sys.exit(1 if regressions or (options.enforce_budgets and over_budget) else 0)
@@ -0,0 +1,651 @@
+import os, sys, math, socket, struct, random, optparse, timeit, collections
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+from pygame.locals import *
+
+from mothership import Game, Player, Mothership, Explosion, FloaterText, OrderedSet, RandomPilot, wait_events, percentile, input_bits, apply_input_bits, SIM_STEP, NUM_STARS, MAX_FPS, RENDER_SCALE, FADE_DELAY
+
+PORT = 47800
+PROTOCOL = 1
+
+# a snapshot is cut to fit one datagram that crosses a LAN unfragmented
+MAX_DATAGRAM = 1200
+# every input packet repeats the latest steps' input, so losing one costs nothing
+INPUT_REDUNDANCY = 8
+# input queued at the host beyond this many steps is skipped, to bound the
+# latency; so is input that sat queued for all of the last BACKLOG_WINDOW steps
+MAX_INPUT_BACKLOG = 3
+BACKLOG_WINDOW = 30
+# steps of input a client runs ahead of the host at most
+MAX_PREDICTION = 30
+# snapshots both ends keep as delta baselines
+SNAPSHOT_HISTORY = 64
+# milliseconds of silence before the host frees a player's slot, or a client stops trying to join
+TIMEOUT = 5000
+
+# replicated classes and the fields a client draws them with, as (attribute,
+# quantum) pairs: numbers travel as int16s in units of 1/quantum, strings as
+# indices into net_strings()
+NET_TYPES = [
+	(Player, (('x', 4), ('y', 4), ('x_speed', 64), ('y_speed', 64), ('current_frame', None), ('slot', 1))),
+	(Mothership, (('x', 4), ('y', 4), ('current_frame', None), ('tint_alpha', 1))),
+	(Explosion, (('x', 4), ('y', 4), ('radius', 1), ('stage', 1), ('max_stages', 1))),
+	(FloaterText, (('x', 4), ('y', 4), ('alpha', 1), ('text', None))),
+]
+NET_TEXTS = ('1up',)
+# NET_TYPES from here on are effects, sent after the missiles
+EFFECTS = 2
+
+HELLO, WELCOME, INPUT, SNAPSHOT = range(1, 5)
+
+# kind, protocol
+HELLO_PACKET = struct.Struct('<BB')
+# kind, slot, players
+WELCOME_PACKET = struct.Struct('<BBB')
+# kind, newest input step, newest snapshot received, input count; followed
+# by the input bits of that many steps, oldest first
+INPUT_PACKET = struct.Struct('<BIIB')
+# kind, sequence, baseline (0 for none), client input step the host ran last,
+# score, lives, flags, then the counts of removed ids, entity records and missiles
+SNAPSHOT_HEADER = struct.Struct('<BIIIihBHHH')
+REMOVED = struct.Struct('<H')
+# id and a mask of the fields that follow; NEW records carry their type and every field
+ENTITY = struct.Struct('<HB')
+NET_TYPE = struct.Struct('<B')
+FIELD = struct.Struct('<h')
+# x, and y doubled with the lowest bit set for missiles flying down
+MISSILE = struct.Struct('<hh')
+
+NEW = 0x80
+GAME_OVER = 1
+
+timer = timeit.default_timer
+
+def quantize(value, quantum, limit=32767): return max(-limit-1, min(limit, int(round(value * quantum))))
+
+def net_strings(game): return sorted(game.sprites.frames) + list(NET_TEXTS)
+
+class Channel(object):
+
+	# a non-blocking UDP socket. lag (ms) and loss (0-1) can be simulated on
+	# the way out, for trying prediction on loopback; lagged datagrams leave on
+	# the next receive() after they are due
+
+	def __init__(self, address=('', 0), lag=0, loss=0.0):
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.socket.bind(address)
+		self.socket.setblocking(False)
+		self.lag = lag / 1000.0
+		self.loss = loss
+		self.random = random.Random(0)
+		self.delayed = collections.deque()
+		self.bytes_sent = 0
+		self.bytes_received = 0
+
+	def send(self, data, address):
+		self.bytes_sent += len(data)
+		if self.loss and self.random.random() < self.loss: return
+		if self.lag: self.delayed.append((timer() + self.lag, data, address))
+		else: self.transmit(data, address)
+
+	def transmit(self, data, address):
+		# a full buffer or an unreachable peer drops the datagram, as the network may
+		try: self.socket.sendto(data, address)
+		except socket.error: pass
+
+	def receive(self):
+		now = timer()
+		while self.delayed and self.delayed[0][0] <= now:
+			due, data, address = self.delayed.popleft()
+			self.transmit(data, address)
+
+		packets = []
+		while True:
+			try: data, address = self.socket.recvfrom(65536)
+			except socket.error: break
+			self.bytes_received += len(data)
+			if data: packets.append((data, address))
+		return packets
+
+class Replicator(object):
+
+	# numbers the host's objects and captures their replicated fields once a
+	# step, quantized, for every client's snapshot to delta against
+
+	def __init__(self, game):
+		self.types = dict((cls, i) for i, (cls, fields) in enumerate(NET_TYPES))
+		self.strings = dict((string, i) for i, string in enumerate(net_strings(game)))
+		self.ids = {}
+		self.next_id = 1
+
+	def capture(self, objects):
+		used = set(self.ids.itervalues())
+		ids = {}
+		state = {}
+		for object in objects:
+			net_type = self.types.get(type(object))
+			if net_type is None: continue
+			values = self.encode(object, NET_TYPES[net_type][1])
+			if values is None: continue
+
+			id = self.ids.get(object)
+			if id is None:
+				while self.next_id in used: self.next_id = self.next_id % 0xffff + 1
+				id = self.next_id
+				used.add(id)
+			ids[object] = id
+			state[id] = (net_type, values)
+		self.ids = ids
+		return state
+
+	def encode(self, object, fields):
+		values = []
+		for name, quantum in fields:
+			value = getattr(object, name)
+			if quantum is None:
+				value = self.strings.get(value)
+				if value is None: return None
+			else: value = quantize(value, quantum)
+			values.append(value)
+		return tuple(values)
+
+class RemotePlayer(object):
+
+	# a client as the host sees it: the ship it steers, its queued input, and
+	# what it holds after each snapshot sent to it, for later ones to delta
+	# against once it acknowledges receiving them
+
+	def __init__(self, address, slot):
+		self.address = address
+		self.slot = slot
+		self.last_heard = timer()
+
+		self.inputs = collections.deque()
+		self.received = 0
+		self.applied = 0
+		self.bits = 0
+		self.skipped = 0
+		self.steps = 0
+		self.spare = MAX_INPUT_BACKLOG
+
+		self.sequence = 0
+		self.acked = 0
+		self.views = {}
+		self.sent = {}
+		self.sizes = []
+		self.start = timer()
+
+	def receive_input(self, newest, acked, bits):
+		self.last_heard = timer()
+		if acked in self.views: self.acked = max(self.acked, acked)
+		for step, b in enumerate(bits, newest - len(bits) + 1):
+			if step > self.received:
+				self.inputs.append((step, b))
+				self.received = step
+
+	def next_input(self):
+		# a late burst or a client running a little fast leaves input queued;
+		# skip ahead rather than stay that far behind
+		skip = max(0, len(self.inputs) - MAX_INPUT_BACKLOG)
+		self.steps += 1
+		if self.steps % BACKLOG_WINDOW == 0:
+			skip = max(skip, self.spare)
+			self.spare = MAX_INPUT_BACKLOG
+		for i in xrange(min(skip, len(self.inputs))):
+			self.inputs.popleft()
+			self.skipped += 1
+
+		if self.inputs: self.applied, self.bits = self.inputs.popleft()
+		self.spare = min(self.spare, len(self.inputs))
+		return self.bits
+
+	def snapshot(self, game, state, missiles, flags=0):
+		self.sequence += 1
+		baseline = self.acked if self.acked in self.views else 0
+		base = self.views.get(baseline, {})
+		budget = MAX_DATAGRAM - SNAPSHOT_HEADER.size
+		view = {}
+
+		removed = []
+		for id in base:
+			if id in state: continue
+			if budget < REMOVED.size: view[id] = base[id]
+			else:
+				removed.append(REMOVED.pack(id))
+				budget -= REMOVED.size
+
+		# ships first, then missiles, then effects, keeping a quarter of the
+		# datagram for those. what doesn't fit is left out and still differs
+		# from the baseline next time, when it goes ahead of what did fit
+		entities = sorted(state.iteritems(), key=lambda (id, (net_type, values)): (net_type, self.sent.get(id, 0)))
+		ships = [entity for entity in entities if entity[1][0] < EFFECTS]
+		effects = [entity for entity in entities if entity[1][0] >= EFFECTS]
+
+		records = []
+		budget = self.delta(ships, base, view, records, budget)
+
+		# missiles move every step, so they go out whole rather than as deltas,
+		# the ones nearest this client's ship first when they don't all fit
+		room = max(0, budget - MAX_DATAGRAM // 4) // MISSILE.size
+		if len(missiles) > room:
+			ship = game.players[self.slot]
+			missiles = sorted(missiles, key=lambda (x, y, direction): abs(x - ship.x) + abs(y - ship.y))[:room]
+		missiles = [MISSILE.pack(quantize(x, 1), quantize(y, 1, 16383) * 2 + (direction > 0)) for x, y, direction in missiles]
+		budget -= len(missiles) * MISSILE.size
+
+		self.delta(effects, base, view, records, budget)
+
+		self.views[self.sequence] = view
+		self.views.pop(self.sequence - SNAPSHOT_HISTORY, None)
+		self.sent = dict((id, self.sent[id]) for id in state if id in self.sent)
+
+		header = SNAPSHOT_HEADER.pack(SNAPSHOT, self.sequence, baseline, self.applied, game.score, quantize(game.lives, 1), flags, len(removed), len(records), len(missiles))
+		data = ''.join([header] + removed + records + missiles)
+		self.sizes.append(len(data))
+		return data
+
+	def delta(self, entities, base, view, records, budget):
+		for id, (net_type, values) in entities:
+			old = base.get(id)
+			if old == (net_type, values):
+				view[id] = old
+				continue
+
+			if old is None or old[0] != net_type:
+				record = ENTITY.pack(id, NEW | (1 << len(values)) - 1) + NET_TYPE.pack(net_type) + ''.join(FIELD.pack(v) for v in values)
+			else:
+				changed = [i for i, (a, b) in enumerate(zip(old[1], values)) if a != b]
+				record = ENTITY.pack(id, sum(1 << i for i in changed)) + ''.join(FIELD.pack(values[i]) for i in changed)
+
+			if len(record) > budget:
+				if old is not None: view[id] = old
+				continue
+			budget -= len(record)
+			records.append(record)
+			view[id] = (net_type, values)
+			self.sent[id] = self.sequence
+		return budget
+
+	def report(self):
+		seconds = max(timer() - self.start, 1e-9)
+		if not self.sizes: return "player %d (%s:%d): no snapshots sent" % ((self.slot + 1,) + self.address)
+		return "player %d (%s:%d): %d snapshots, %.0f bytes mean, %d max, %.1f kB/s, %d inputs skipped" % (
+			(self.slot + 1,) + self.address + (len(self.sizes), sum(self.sizes) / float(len(self.sizes)), max(self.sizes), sum(self.sizes) / seconds / 1000.0, self.skipped))
+
+class NetHost(object):
+
+	# the authoritative end: applies each client's input to its ship before
+	# every step and sends every client a snapshot after it
+
+	def __init__(self, game, players=2, port=PORT, lag=0, loss=0.0):
+		self.game = game
+		self.players = players
+		self.port = port
+		self.channel = Channel(('', port), lag, loss)
+		self.replicator = Replicator(game)
+		self.clients = {}
+
+	def free_slots(self):
+		taken = set(client.slot for client in self.clients.itervalues())
+		return [slot for slot in xrange(1, self.players) if slot not in taken]
+
+	def poll(self):
+		for data, address in self.channel.receive():
+			kind = ord(data[0])
+			client = self.clients.get(address)
+			if kind == HELLO and len(data) == HELLO_PACKET.size:
+				if HELLO_PACKET.unpack(data)[1] != PROTOCOL: continue
+				if client is None:
+					slots = self.free_slots()
+					if not slots: continue
+					client = self.clients[address] = RemotePlayer(address, slots[0])
+				self.channel.send(WELCOME_PACKET.pack(WELCOME, client.slot, self.players), address)
+			elif kind == INPUT and client and len(data) >= INPUT_PACKET.size:
+				kind, newest, acked, count = INPUT_PACKET.unpack_from(data)
+				client.receive_input(newest, acked, bytearray(data[INPUT_PACKET.size:INPUT_PACKET.size + count]))
+
+		now = timer()
+		for address, client in self.clients.items():
+			if now - client.last_heard > TIMEOUT / 1000.0:
+				print(client.report() + ", timed out")
+				del self.clients[address]
+				if hasattr(self.game, 'players'): apply_input_bits(self.game.players[client.slot], 0)
+
+	def apply_inputs(self):
+		self.poll()
+		for client in self.clients.itervalues(): apply_input_bits(self.game.players[client.slot], client.next_input())
+
+	def send_snapshots(self, flags=0):
+		if not self.clients: return
+		state = self.replicator.capture(self.game.objects)
+		missiles = self.game.projectiles.positions()
+		for client in self.clients.itervalues(): self.channel.send(client.snapshot(self.game, state, missiles, flags), client.address)
+
+	def report(self):
+		for client in self.clients.itervalues(): print(client.report())
+
+class HostGame(Game):
+
+	# the usual game, with the other players' ships steered over the network
+
+	def __init__(self, num_stars=NUM_STARS, players=2, port=PORT, lag=0, loss=0.0, **options):
+		Game.__init__(self, num_stars, **options)
+		self.finish_loading()
+		self.net = NetHost(self, players, port, lag, loss)
+
+	def step(self, ticks):
+		self.net.apply_inputs()
+		Game.step(self, ticks)
+		self.net.send_snapshots()
+
+	def show_game_over(self):
+		# repeated, in case the network loses one
+		for i in xrange(3): self.net.send_snapshots(GAME_OVER)
+		Game.show_game_over(self)
+
+	def wait_for_players(self):
+		text = self.text_cache.render(self.score_font, "Waiting for players on port %d" % self.net.port, (255,255,255))
+		redraw = True
+		while self.net.free_slots():
+			if redraw:
+				self.screen.fill((0,0,0))
+				self.view.blit(text, ((self.width - text.get_width()) / 2, (self.height - text.get_height()) / 2))
+				self.display.present()
+				redraw = False
+
+			for e in wait_events(FADE_DELAY):
+				if e.type == QUIT or e.type == KEYDOWN and e.key == K_ESCAPE: return False
+				elif e.type == VIDEOEXPOSE: redraw = True
+			self.net.poll()
+		return True
+
+	def run(self):
+		pygame.mouse.set_visible(False)
+		if self.wait_for_players(): self.play(self.net.players)
+		pygame.mouse.set_visible(True)
+		self.net.report()
+
+class MissileView(object):
+
+	# stands in for a client's Projectiles, drawing the latest snapshot's missiles
+
+	def __init__(self, game):
+		self.frames = {-1: game.sprites.frames['missile_up'], 1: game.sprites.frames['missile_down']}
+		self.clear()
+
+	def clear(self): self.missiles = []
+
+	def __len__(self): return len(self.missiles)
+
+	def render(self, surface, alpha=1.0):
+		frames = self.frames
+		blits = [(frames[d][0], (x, y), frames[d][1]) for x, y, d in self.missiles]
+		if hasattr(surface, 'blits'): return surface.blits(blits)
+		return [surface.blit(*blit) for blit in blits]
+
+class ClientGame(Game):
+
+	# shows the host's game from its snapshots. only the local ship is
+	# simulated here, ahead of the host: each step's input moves it at once
+	# and is sent off, and each snapshot puts it back where the host has it
+	# and replays the input the host hasn't run yet
+
+	# the host keeps the score; this shadows the free life bookkeeping
+	score = 0
+
+	def __init__(self, host, port=PORT, lag=0, loss=0.0, **options):
+		Game.__init__(self, **options)
+		self.finish_loading()
+		self.address = (socket.gethostbyname(host), port)
+		self.channel = Channel(('', 0), lag, loss)
+		self.projectiles = MissileView(self)
+		self.strings = net_strings(self)
+		if Mothership.frame is None: Mothership.load_frame(self.sprites)
+
+		self.slot = 1
+		self.states = {}
+		self.latest = 0
+		self.proxies = {}
+
+		self.sequence = 0
+		self.inputs = []
+		self.predictions = {}
+		self.sample_times = {}
+		self.unpresented = []
+		self.confirmed = []
+		self.latencies = collections.defaultdict(list)
+		self.prediction_errors = []
+		self.start = timer()
+
+	def join(self, idle=None):
+		# says hello until the host answers; idle runs while waiting, it
+		# drives the host when both ends share a process
+		hello = HELLO_PACKET.pack(HELLO, PROTOCOL)
+		start = timer()
+		while timer() - start < TIMEOUT / 1000.0:
+			self.channel.send(hello, self.address)
+			retry = timer() + 0.25
+			while timer() < retry:
+				if idle: idle()
+				for data, address in self.channel.receive():
+					if address == self.address and len(data) == WELCOME_PACKET.size and ord(data[0]) == WELCOME:
+						kind, self.slot, self.num_players = WELCOME_PACKET.unpack(data)
+						return True
+				for e in pygame.event.get():
+					if e.type == QUIT or e.type == KEYDOWN and e.key == K_ESCAPE: return False
+				pygame.time.delay(5)
+		return False
+
+	def setup_game(self, seed=None, players=1):
+		Game.setup_game(self, seed, players)
+		self.player = self.players[self.slot]
+		self.objects = OrderedSet([self.player])
+		self.proxies = {}
+
+	def handle_input(self):
+		# the previous frame has just been presented
+		self.presented(timer())
+		Game.handle_input(self)
+
+	def handle_keypress(self, key):
+		# the host's game can't pause for one player
+		if key == K_ESCAPE: self.main_loop_done = True
+		else: Game.handle_keypress(self, key)
+
+	def update(self, ticks=None):
+		self.receive()
+		Game.update(self, ticks)
+
+	def step(self, ticks):
+		player = self.player
+		self.sequence += 1
+		self.inputs.append((self.sequence, input_bits(player)))
+		del self.inputs[:-MAX_PREDICTION]
+
+		now = timer()
+		self.sample_times[self.sequence] = now
+		self.sample_times.pop(self.sequence - MAX_PREDICTION, None)
+		self.unpresented.append(now)
+
+		recent = self.inputs[-INPUT_REDUNDANCY:]
+		data = INPUT_PACKET.pack(INPUT, self.sequence, self.latest, len(recent)) + str(bytearray(bits for step, bits in recent))
+		self.channel.send(data, self.address)
+
+		player.prev_x, player.prev_y = player.x, player.y
+		player.move(ticks)
+		self.predictions[self.sequence] = (player.x, player.y)
+		self.predictions.pop(self.sequence - MAX_PREDICTION, None)
+
+	def presented(self, now):
+		for sampled in self.unpresented: self.latencies['predicted'].append(now - sampled)
+		for sampled in self.confirmed: self.latencies['confirmed'].append(now - sampled)
+		self.unpresented = []
+		self.confirmed = []
+
+	def receive(self):
+		for data, address in self.channel.receive():
+			if address != self.address or ord(data[0]) != SNAPSHOT: continue
+			snapshot = self.decode(data)
+			if snapshot: self.apply(*snapshot)
+
+	def decode(self, data):
+		try:
+			kind, sequence, baseline, last_input, score, lives, flags, removed, entities, missiles = SNAPSHOT_HEADER.unpack_from(data)
+			# late, or against a baseline long forgotten
+			if sequence <= self.latest or baseline and baseline not in self.states: return None
+
+			state = dict(self.states.get(baseline, {}))
+			offset = SNAPSHOT_HEADER.size
+			for i in xrange(removed):
+				state.pop(REMOVED.unpack_from(data, offset)[0], None)
+				offset += REMOVED.size
+
+			for i in xrange(entities):
+				id, mask = ENTITY.unpack_from(data, offset)
+				offset += ENTITY.size
+				if mask & NEW:
+					net_type = NET_TYPE.unpack_from(data, offset)[0]
+					offset += NET_TYPE.size
+					values = [0] * len(NET_TYPES[net_type][1])
+				else:
+					net_type, values = state[id]
+					values = list(values)
+				for field in xrange(len(values)):
+					if mask & 1 << field:
+						values[field] = FIELD.unpack_from(data, offset)[0]
+						offset += FIELD.size
+				state[id] = (net_type, tuple(values))
+
+			positions = []
+			for i in xrange(missiles):
+				x, y = MISSILE.unpack_from(data, offset)
+				offset += MISSILE.size
+				positions.append((x, y >> 1, 1 if y & 1 else -1))
+		except (struct.error, KeyError, IndexError): return None
+
+		self.states[sequence] = state
+		for old in [s for s in self.states if s <= sequence - SNAPSHOT_HISTORY]: del self.states[old]
+		self.latest = sequence
+		return state, last_input, score, lives, flags, positions
+
+	def apply(self, state, last_input, score, lives, flags, missiles):
+		self.score, self.lives = score, lives
+		self.projectiles.missiles = missiles
+
+		proxies = {}
+		objects = [self.player]
+		for id, (net_type, values) in sorted(state.iteritems()):
+			cls, fields = NET_TYPES[net_type]
+			proxy = self.proxies.get(id)
+			if proxy is None or type(proxy) is not cls:
+				# drawn by the class's own render, never updated here
+				proxy = cls.__new__(cls)
+				proxy.game = self
+				prev = None, None
+				if cls is Explosion: self.sounds.play('explosion')
+			else: prev = proxy.x, proxy.y
+
+			for (name, quantum), value in zip(fields, values):
+				if quantum is None: value = self.strings[value]
+				elif quantum != 1: value = value / float(quantum)
+				setattr(proxy, name, value)
+			proxy.prev_x, proxy.prev_y = prev
+			proxies[id] = proxy
+
+			if cls is Player and proxy.slot == self.slot: self.reconcile(proxy, last_input)
+			else: objects.append(proxy)
+		self.proxies = proxies
+		self.objects = OrderedSet(objects)
+
+		if flags & GAME_OVER: self.show_game_over()
+
+	def reconcile(self, ship, last_input):
+		player = self.player
+		predicted = self.predictions.get(last_input)
+		if predicted: self.prediction_errors.append(math.hypot(ship.x - predicted[0], ship.y - predicted[1]))
+
+		for step in sorted(self.sample_times):
+			if step > last_input: break
+			self.confirmed.append(self.sample_times.pop(step))
+
+		bits = input_bits(player)
+		player.x, player.y, player.x_speed, player.y_speed = ship.x, ship.y, ship.x_speed, ship.y_speed
+		self.inputs = [(step, b) for step, b in self.inputs if step > last_input]
+		for step, b in self.inputs:
+			apply_input_bits(player, b)
+			player.move(SIM_STEP)
+		apply_input_bits(player, bits)
+
+	def report(self):
+		seconds = max(timer() - self.start, 1e-9)
+		print("received %.1f kB/s, sent %.1f kB/s, %d snapshots" % (self.channel.bytes_received / seconds / 1000.0, self.channel.bytes_sent / seconds / 1000.0, self.latest))
+		for key in ('predicted', 'confirmed'):
+			samples = self.latencies[key]
+			if samples: print("input to screen, %s: p50 %.1fms  p99 %.1fms" % (key, percentile(samples, 0.5) * 1000.0, percentile(samples, 0.99) * 1000.0))
+		if self.prediction_errors:
+			print("prediction error: p50 %.2fpx  p99 %.2fpx" % (percentile(self.prediction_errors, 0.5), percentile(self.prediction_errors, 0.99)))
+
+	def run(self):
+		if not self.join():
+			print("no answer from %s:%d" % self.address)
+			return False
+		pygame.mouse.set_visible(False)
+		self.play(self.num_players)
+		pygame.mouse.set_visible(True)
+		self.report()
+		return True
+
+def run_loopback(steps, port=PORT, lag=0, loss=0.0, seed=0, num_stars=0, fps=60):
+	# host and client in one process, headless, talking over loopback with
+	# random pilots on both ships
+	host = HostGame(num_stars, port=port, lag=lag, loss=loss, headless=True)
+	client = ClientGame('localhost', port, lag, loss, num_stars=num_stars, headless=True)
+	if not client.join(host.net.poll): raise SystemExit("the client could not join")
+
+	host.main_loop_done = client.main_loop_done = False
+	host.setup_game(seed, players=host.net.players)
+	client.setup_game(players=client.num_players)
+	host_pilot, client_pilot = RandomPilot(seed), RandomPilot(seed + 1)
+
+	clock = pygame.time.Clock()
+	frame = 0
+	while client.sequence < steps and not (host.main_loop_done or client.main_loop_done):
+		host_pilot(host, frame)
+		host.update()
+		client_pilot(client, frame)
+		client.update()
+		client.render()
+		client.display.present()
+		client.presented(timer())
+		clock.tick(fps)
+		frame += 1
+
+	host.net.report()
+	client.report()
+	return client
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage="%prog --host | --join HOST | --loopback [options]")
+	parser.add_option("--host", action="store_true", default=False, help="run the game and wait for another player to join")
+	parser.add_option("--join", metavar="HOST", help="join the game hosted at this address")
+	parser.add_option("--loopback", action="store_true", default=False, help="host and join in this process, headless, with random pilots, and report bandwidth and latency")
+	parser.add_option("--port", type="int", default=PORT, help="UDP port of the host")
+	parser.add_option("--players", type="int", default=2, help="ships in a hosted game, all but the first joined over the network")
+	parser.add_option("--lag", type="int", default=0, help="simulated one-way latency in milliseconds")
+	parser.add_option("--loss", type="float", default=0.0, help="simulated packet loss, 0-1")
+	parser.add_option("--steps", type="int", default=900, help="client steps to run with --loopback")
+	parser.add_option("--seed", type="int", default=0, help="random seed for --loopback")
+	parser.add_option("--stars", type="int", default=NUM_STARS, help="number of background stars")
+	parser.add_option("--max-fps", type="int", default=MAX_FPS, help="frame rate cap, 0 for uncapped")
+	parser.add_option("--low-latency", action="store_true", default=False, help="wait for the frame cap before reading input, not after")
+	parser.add_option("--render-scale", type="float", default=RENDER_SCALE, help="internal render resolution relative to the logical one")
+	options, args = parser.parse_args()
+
+	if options.loopback: run_loopback(options.steps, options.port, options.lag, options.loss, options.seed)
+	elif options.host: HostGame(options.stars, options.players, options.port, options.lag, options.loss, max_fps=options.max_fps, render_scale=options.render_scale, low_latency=options.low_latency).run()
+	elif options.join:
+		client = ClientGame(options.join, options.port, options.lag, options.loss, num_stars=options.stars, max_fps=options.max_fps, render_scale=options.render_scale, low_latency=options.low_latency)
+		if not client.run(): sys.exit(1)
+	else: parser.error("one of --host, --join or --loopback is needed")
@@ -1,119 +1,231 @@
-import random, math, zipfile, os
+import random, math, zipfile, os, sys, collections, time, gc, cProfile, struct, bisect, tempfile, weakref, warnings, threading
 
 import pygame
 from pygame.locals import *
 
+try: import numpy
+except ImportError: numpy = None
+
+# startup times (Game.startup) count from here
+START_TIME = time.time()
+
+# the game is played in RESOLUTION logical coordinates; frames are drawn at
+# RENDER_SCALE times that size and stretched to fit the monitor
 RESOLUTION = (800,600)
+RENDER_SCALE = 1.0
+NUM_STARS = 100
+
+# the simulation always advances in fixed 30Hz steps, independent of the frame rate
+SIM_STEP = 1000.0 / 30
+MAX_FRAME_TIME = 250
+MAX_FPS = 0
+
+# low latency mode sleeps off the frame cap before sampling input instead of
+# between sampling it and acting on it, and steers by KEYDOWN/KEYUP events
+LOW_LATENCY = False
+# keys that steer the ship; their presses are timed until they reach the screen
+CONTROL_KEYS = (K_LEFT, K_RIGHT, K_UP, K_DOWN, K_SPACE)
+
+PROFILE_FRAMES = 300
+
+# difficulty tuning, overridable per game for balance sweeps (see sweep.py).
+# the boss's timings and toughness scale with the difficulty, which grows
+# by a growing step every time a boss is destroyed
+BALANCE = {
+	'fire_interval': 100, # first shot delay, plus fire_interval_factor * difficulty_factor
+	'fire_interval_factor': 100,
+	'max_fire_interval': 5000, # divided by difficulty
+	'tolerance': 10, # plus difficulty
+	'boss_hits': 10, # times difficulty
+	'difficulty_factor': 0.1, # starting difficulty step
+	'difficulty_ramp': 0.1, # growth of the step per boss destroyed
+}
+
+# menus redraw at this interval while fading, and otherwise sleep in the
+# event queue until input arrives or the idle timeout passes
+FADE_DELAY = 50
+IDLE_WAIT = 1000
+
+# ship and missile art, packed into one SpriteAtlas at startup
+SPRITES = [
+	'resources/plane.gif',
+	'resources/plane_turning_left_1.gif',
+	'resources/plane_turning_left_2.gif',
+	'resources/plane_turning_right_1.gif',
+	'resources/plane_turning_right_2.gif',
+	'resources/Nightmare.gif',
+	'resources/missile00.png',
+]
+
+# sound effects: name, file, volume, priority, voices
+SOUNDS = [
+	('explosion', 'resources/explosion.ogg', 0.4, 2, 4),
+	('missile', 'resources/missile.ogg', 0.1, 1, 3),
+	('oneup', 'resources/oneup.ogg', 0.8, 3, 1),
+]
+
+MUSIC_PLAYLIST = ['resources/bgm.ogg']
+MUSIC_END = USEREVENT + 1
+MAX_VOICES = 8
+
+# posted by the AssetLoader's thread when it is done
+ASSETS_LOADED = USEREVENT + 2
+
+# every object belongs to one layer; each layer lists the layers it can hit,
+# pairs not listed here are never tested for collisions
+LAYERS = ('player', 'mothership', 'player_missile', 'enemy_missile', 'effect')
+COLLISION_LAYERS = {
+	'player': ('mothership', 'enemy_missile'),
+	'player_missile': ('mothership', 'enemy_missile'),
+	'enemy_missile': ('player', 'player_missile'),
+}
+# missiles aren't objects, they live in the game's Projectiles
+PROJECTILE_LAYERS = ('player_missile', 'enemy_missile')
+TARGET_LAYERS = sorted(set(layer for targets in COLLISION_LAYERS.values() for layer in targets) - set(PROJECTILE_LAYERS))
+
+def wait_events(timeout):
+	# blocks in SDL instead of polling; pygame 1.9 can't time out a wait
+	try: event = pygame.event.wait(timeout)
+	except TypeError:
+		pygame.time.delay(timeout)
+		return pygame.event.get()
+	events = [] if event.type == NOEVENT else [event]
+	return events + pygame.event.get()
+
+def percentile(samples, q):
+	samples = sorted(samples)
+	return samples[min(len(samples)-1, int(len(samples) * q))]
 
 class TitleScreen(object):
 	
+	labels = {'play': "Play", 'highscores': "High Scores", 'quit': "Quit"}
+	
 	def __init__(self, game, alpha=0, show_high_scores=True):
 		self.game = game
-		self.screen = pygame.display.get_surface()
-		self.screen.fill((0,0,0))
-		self.choice_font = pygame.font.Font('resources/century.ttf', 30)
+		game.screen.fill((0,0,0))
+		self.choice_font = assets.font('resources/century.ttf', 30)
 		self.alpha = alpha		
 		self.modes = ['play', 'highscores', 'quit'] if show_high_scores else ['play', 'quit']
 		self.show_high_scores = show_high_scores
-		
-	def run(self): 		
 		self.mode_selected = 0
-		self.title_text = pygame.font.Font('resources/century.ttf', 80).render("Mothership", True, (255, 90, 0))
+		self.title_text = game.text_cache.render(assets.font('resources/century.ttf', 80), "Mothership", (255, 90, 0))
+		self.frame = None
+		self.composed = None
+		self.dirty = True
 		
+	def run(self): 		
 		self.done = False
 		while not self.done:
-			self.handle_input()
-			self.render()
+			if self.dirty or self.alpha < 255: self.render()
+			
+			if self.alpha < 255:
+				pygame.time.delay(FADE_DELAY)
+				self.handle_input()
+				self.alpha = min(255, self.alpha + 1)
+			else: self.handle_input(wait_events(IDLE_WAIT))
 			
 		return self.modes[self.mode_selected]
 
-	def handle_input(self):
-		events = pygame.event.get()
+	def handle_input(self, events=None):
+		if events is None: events = pygame.event.get()
 		for e in events:
 			if e.type == KEYDOWN:
 				if e.key == K_DOWN: self.mode_selected += 1
 				elif e.key == K_UP: self.mode_selected -= 1
 				elif e.key == K_RETURN: self.done = True
 			elif e.type == QUIT: self.done = True
+			elif e.type == VIDEOEXPOSE: self.dirty = True
+			elif e.type == MUSIC_END: self.game.music.track_ended()
+			elif e.type == ASSETS_LOADED: self.game.finish_loading()
 				
 		if self.mode_selected > len(self.modes)-1: self.mode_selected = 0
 		if self.mode_selected < 0: self.mode_selected = len(self.modes) - 1
+		if self.mode_selected != self.composed: self.dirty = True
 
-	def render(self):
-		surf = pygame.Surface(RESOLUTION)
+	def compose(self):
+		# a fresh surface each time, so the view never shows a stale scaled copy
+		surf = self.frame = pygame.Surface(RESOLUTION)
 		sw, sh = surf.get_size()
 		
 		tx = (sw - self.title_text.get_width()) / 2
 		ty = (sh - self.title_text.get_height()) / 4
-		
 		surf.blit(self.title_text, (tx, ty))
-
-		if self.show_high_scores:
-			if self.mode_selected == 0:
-				play_choice = self.choice_font.render("Play", True, (255,255,255))
-				score_choice = self.choice_font.render("High Scores", True, (100,100,100))
-				quit_choice = self.choice_font.render("Quit", True, (100,100,100))
-			elif self.mode_selected == 1:
-				play_choice = self.choice_font.render("Play", True, (100,100,100))
-				score_choice = self.choice_font.render("High Scores", True, (255,255,255))
-				quit_choice = self.choice_font.render("Quit", True, (100,100,100))
-			elif self.mode_selected == 2:
-				play_choice = self.choice_font.render("Play", True, (100,100,100))
-				score_choice = self.choice_font.render("High Scores", True, (100,100,100))
-				quit_choice = self.choice_font.render("Quit", True, (255,255,255))
-
-			c1x = (sw - play_choice.get_width()) / 2
-			c1y = (sh - play_choice.get_height()) / 2
-			
-			c2x = (sw - score_choice.get_width()) / 2
-			c2y = c1y + 40
-			
-			c3x = (sw - quit_choice.get_width()) / 2
-			c3y = c2y + 40
-				
-			surf.blit(play_choice, (c1x, c1y))
-			surf.blit(score_choice, (c2x, c2y))									
-			surf.blit(quit_choice, (c3x, c3y))
-			
-		else:
-			if self.mode_selected == 0:
-				play_choice = self.choice_font.render("Play", True, (255,255,255))
-				quit_choice = self.choice_font.render("Quit", True, (100,100,100))
-			elif self.mode_selected == 1:
-				play_choice = self.choice_font.render("Play", True, (100,100,100))
-				quit_choice = self.choice_font.render("Quit", True, (255,255,255))			
-			
-			c1x = (sw - play_choice.get_width()) / 2
-			c1y = (sh - play_choice.get_height()) / 2
-			
-			c2x = (sw - quit_choice.get_width()) / 2
-			c2y = c1y + 40			
-				
-			surf.blit(play_choice, (c1x, c1y))
-			surf.blit(quit_choice, (c2x, c2y))
+		
+		cy = None
+		for i, mode in enumerate(self.modes):
+			c = (255,255,255) if i == self.mode_selected else (100,100,100)
+			choice = self.game.text_cache.render(self.choice_font, self.labels[mode], c)
+			if cy is None: cy = (sh - choice.get_height()) / 2
+			surf.blit(choice, ((sw - choice.get_width()) / 2, cy))
+			cy += 40
 			
-		surf.set_alpha(self.alpha)
-		self.screen.blit(surf, (0,0))
-		pygame.display.flip()
-		surf.fill((0,0,0))
-		pygame.time.delay(50)
-		self.alpha += 1
-		self.alpha = min(255, self.alpha)
+		self.composed = self.mode_selected
+
+	def render(self):
+		if self.composed != self.mode_selected: self.compose()
+		self.frame.set_alpha(self.alpha)
+		self.game.view.blit(self.frame, (0,0))
+		self.game.display.present()
+		self.game.startup.setdefault('first frame', time.time() - START_TIME)
+		self.dirty = False
 		
 class Object(object):
 	
+	__slots__ = ()
+	
 	hits = 0
+	hit_mask = None
+	layer = 'effect'
+	prev_x = None
+	prev_y = None
 	
 	def __repr__(self): return "Generic Object"
 	def __str__(self): return "Generic Object"
 	
+	def interpolated_position(self, alpha):
+		if self.prev_x is None: return self.x, self.y
+		return self.prev_x + (self.x - self.prev_x) * alpha, self.prev_y + (self.y - self.prev_y) * alpha
+		
 	def collides_with(self, object):
-		return self.x >= object.x and self.x <= object.x+object.width and self.y >= object.y and self.y <= object.y+object.height
+		if not (self.x >= object.x and self.x <= object.x+object.width and self.y >= object.y and self.y <= object.y+object.height): return False
+		if object.hit_mask is None: return True
+		
+		# pixel-accurate narrowphase against objects that carry a bitmask
+		ox, oy = int(self.x - object.x), int(self.y - object.y)
+		if self.hit_mask is not None: return object.hit_mask.overlap(self.hit_mask, (ox, oy)) is not None
+		
+		mw, mh = object.hit_mask.get_size()
+		return ox < mw and oy < mh and object.hit_mask.get_at((ox, oy)) != 0
+		
+	def release(self): pass
 
-class FloaterText(Object):
+class Pooled(object):
+	
+	# short-lived objects are recycled through a per-class free list instead
+	# of being reallocated; subclasses define their own pool list
+	
+	__slots__ = ()
+	max_pool = 4096
+	
+	@classmethod
+	def spawn(cls, *args, **kwargs):
+		if cls.pool:
+			object = cls.pool.pop()
+			object.__init__(*args, **kwargs)
+			return object
+		return cls(*args, **kwargs)
+		
+	def release(self):
+		if len(self.pool) < self.max_pool: self.pool.append(self)
+
+class FloaterText(Pooled, Object):
+	
+	__slots__ = ('game', 'x', 'y', 'prev_x', 'prev_y', 'width', 'height', 'text', 'time', 'current_time', 'speed', 'alpha')
+	pool = []
 	
 	def __init__(self, game, (x,y), text, time=2000):
 		self.game = game
+		self.prev_x = self.prev_y = None
 		self.x, self.y = x, y
 		self.text = text
 		self.time = time
@@ -133,10 +245,14 @@ class FloaterText(Object):
 		self.alpha = 255 - ( (float(self.current_time) / float(self.time)) * 255.)
 		
 	def render(self, surface):
-		txt = self.game.float_font.render(self.text, True, (self.alpha,self.alpha,self.alpha))
-		surface.blit(txt, (self.x, self.y))
+		txt = self.game.text_cache.render(self.game.float_font, self.text, (255,255,255))
+		txt.set_alpha(int(self.alpha))
+		return surface.blit(txt, (self.x, self.y))
 		
-class Explosion(Object):
+class Explosion(Pooled, Object):
+	
+	__slots__ = ('game', 'x', 'y', 'prev_x', 'prev_y', 'width', 'height', 'radius', 'stage', 'max_stages', 'stage_interval', 'current_ticks')
+	pool = []
 	
 	def __repr__(self): return "Explosion"
 	def __str__(self): return "Explosion"
@@ -144,13 +260,14 @@ class Explosion(Object):
 	def __init__(self, game, (x,y), magnitude):
 		self.game = game
 		self.x, self.y = x, y
+		self.prev_x = self.prev_y = None
 		self.width, self.height = 0,0
 		self.radius = 1
 		self.stage = 0
 		self.max_stages = max(1,magnitude)
 		self.stage_interval = 200
 		self.current_ticks = 0
-		self.game.explosion_sound.play()
+		self.game.sounds.play('explosion')
 		
 	def update(self, ticks):
 		
@@ -165,74 +282,27 @@ class Explosion(Object):
 		self.radius += 2
 	
 	def render(self, surface):		
-		surf = pygame.Surface((self.radius*2+5, self.radius*2+5)).convert_alpha()
-		surf.fill((0,0,0,0))
-		surf.lock()
-		r = random.randint(6, max(10, 6*self.stage))
-		for i in range(r):
-			x = self.radius * math.cos(i) + self.radius
-			y = self.radius * math.sin(i) + self.radius
-			sz = random.randint(1,3)
-			c = (max(0, 255-self.stage*(255/self.max_stages)),0,0)
-			if sz == 1: surf.set_at((int(x),int(y)), c)
-			else: pygame.draw.circle(surf, c, (int(x), int(y)), sz)
-			
-		surf.unlock()
-				
-		surface.blit(surf, (self.x-self.radius, self.y-self.radius))
+		return self.game.explosion_frames.draw(surface, self.max_stages, self.stage, (self.x, self.y), self.radius)
 		
 	def hit(self, hitter): pass
 		
 class Missile(Object):
+	
+	# what a target sees of a missile that hit it; missiles in flight are
+	# rows in the game's Projectiles rather than objects of their own
+	
+	__slots__ = ('x', 'y', 'width', 'height', 'owner', 'layer', 'dir', 'hit_mask')
+	
 	def __repr__(self): return "Missile"
 	def __str__(self): return "Missile"
 	
-	def __init__(self, owner, game, velocity=0.5, acceleration=1.1, direction=-1):
+	def __init__(self, (x, y), (width, height), owner, layer, direction, hit_mask):
+		self.x, self.y = x, y
+		self.width, self.height = width, height
 		self.owner = owner
-		self.game = game
-		self.vel = velocity
-		self.accel = acceleration
+		self.layer = layer
 		self.dir = direction
-		
-		self.image = self.game.missile_image_up if direction == -1 else self.game.missile_image_down
-		self.width, self.height = self.image.get_size()
-
-		self.x = (owner.x+(owner.width-self.width)/2)
-		self.y = owner.y - self.height/2 if direction == -1 else owner.y + owner.height
-		
-		self.game.missile_sound.play()
-		
-	def update(self, ticks):
-		self.y += self.dir * self.vel
-		self.vel *= self.accel
-		
-		if self.dir == -1 and self.y < 0: self.game.remove_object(self)
-		elif self.dir == 1 and self.y > self.game.screen.get_height(): self.game.remove_object(self)
-		
-		for object in self.game.objects:
-			if self.is_valid_target(object) and self.collides_with(object): 
-				self.game.remove_object(self)
-				self.game.add_object(Explosion(self.game, (self.x+self.width/2, self.y+self.height/2), 5))		
-				object.hit(self)
-			
-	def is_valid_target(self, object):
-		if object == self: return False
-		
-		if isinstance(object, Missile):
-			if object.owner != self.owner: return True
-		else:
-			if self.owner != object: return True
-			
-		return False
-					
-	def hit(self, hitter):
-		if self in self.game.objects: self.game.remove_object(self)
-		self.game.score += 50		
-		
-	def collides_with(self, object):
-		return self.x >= object.x and self.x <= object.x+object.width and self.y >= object.y and self.y <= object.y+object.height
-		
-	def render(self, surface): surface.blit(self.image, (self.x, self.y))
+		self.hit_mask = hit_mask
 
 class Ship(Object):
 	
@@ -241,9 +311,8 @@ class Ship(Object):
 	
 	width = 32
 	height = 32
-	x = 400
-	y = 500
 	color = (200,0,0)
+	missile_layer = 'enemy_missile'
 
 	def __init__(self, game):
 		self.x_speed = 0
@@ -251,6 +320,7 @@ class Ship(Object):
 		self.y_speed = 0
 		self.y_factor = 1
 		self.game = game
+		self.x, self.y = self.spawn_position()
 		self.moving_left = False
 		self.moving_right = False
 		self.moving_up = False
@@ -268,37 +338,46 @@ class Ship(Object):
 		self.x_speed *= 0.9 # deceleration
 		self.y_speed *= 0.9
 
+	def spawn_position(self): return self.game.width/2, self.game.height-100
+		
 	def render(self, surface):		
-		pygame.draw.rect(surface, self.color, (self.x, self.y, self.width, self.height), 2)
+		return pygame.draw.rect(surface, self.color, (self.x, self.y, self.width, self.height), 2)
 
 class Player(Ship):
 	
 	def __repr__(self): return "Player Ship"
 	def __str__(self): return "Player Ship"
 	
+	layer = 'player'
+	missile_layer = 'player_missile'
+	
 	fire_interval = 150
 	current_ticks = 0
 	can_fire = True
+	firing = False
 	invincible = 0
 	
-	def __init__(self, game):
+	def __init__(self, game, slot=0):
+		# co-op players line up side by side, slot 0 on the left
+		self.slot = slot
 		Ship.__init__(self, game)
 		
-		self.main_frame = pygame.image.load('resources/plane.gif').convert()
-		self.left_frame1 = pygame.image.load('resources/plane_turning_left_1.gif').convert()
-		self.left_frame2 = pygame.image.load('resources/plane_turning_left_2.gif').convert()
-		self.right_frame1 = pygame.image.load('resources/plane_turning_right_1.gif').convert()
-		self.right_frame2 = pygame.image.load('resources/plane_turning_right_2.gif').convert()
+		self.main_frame = 'plane'
+		self.left_frame1 = 'plane_turning_left_1'
+		self.left_frame2 = 'plane_turning_left_2'
+		self.right_frame1 = 'plane_turning_right_1'
+		self.right_frame2 = 'plane_turning_right_2'
 		
 		self.current_frame = self.main_frame
 	
+	def spawn_position(self):
+		x, y = Ship.spawn_position(self)
+		return x + (2*self.slot - (self.game.num_players-1)) * 40, y
+		
 	def update(self, ticks):
-		Ship.update(self, ticks)
+		if self.firing: self.fire()
 		
-		self.y = max(0, self.y)
-		self.y = min(self.y, self.game.screen.get_height()-self.height)
-		self.x = max(-self.width/2, self.x)
-		self.x = min(self.x, self.game.screen.get_width()-self.width/2)
+		self.move(ticks)
 
 		if self.invincible > 0: self.invincible -= ticks
 		
@@ -307,19 +386,28 @@ class Player(Ship):
 		if self.current_ticks > self.fire_interval: 
 			self.can_fire = True
 			self.current_ticks = 0
+		
+		for layer in COLLISION_LAYERS[self.layer]:
+			for obj in self.game.objects_at(layer, self.x, self.y):
+				if self.collides_with(obj): self.hit(obj)
 
+	def move(self, ticks):
+		# steering alone, which is all a network client predicts of its ship
+		Ship.update(self, ticks)
+		
+		self.y = max(0, self.y)
+		self.y = min(self.y, self.game.height-self.height)
+		self.x = max(-self.width/2, self.x)
+		self.x = min(self.x, self.game.width-self.width/2)
+		
 		if self.x_speed > -1 and self.x_speed < 1: self.current_frame = self.main_frame
 		elif self.x_speed <= -1 and self.x_speed > -4: self.current_frame = self.left_frame1
 		elif self.x_speed <= -4: self.current_frame = self.left_frame2
 		elif self.x_speed >= 1 and self.x_speed < 4: self.current_frame = self.right_frame1
 		elif self.x_speed >= 4: self.current_frame = self.right_frame2
 			
-		self.width = self.current_frame.get_width()
-		self.height = self.current_frame.get_height()
+		self.width, self.height = self.game.sprites.size(self.current_frame)
 		
-		for obj in self.game.objects:
-			if self != obj and self.collides_with(obj): self.hit(obj)
-
 	def hit(self, hitter):
 		assert isinstance(hitter, Object), "Can only be hit by Objects"
 		
@@ -327,12 +415,13 @@ class Player(Ship):
 		if isinstance(hitter, Missile):
 			if hitter.owner == self: return
 			
-		for i in range(random.randint(1,10)):
-			x = random.randint(-30,30)
-			self.game.add_object(Explosion(self.game, (x+self.x+self.width/2, x+self.y+self.height/2), 10))
+		for i in range(self.game.random.randint(1,10)):
+			x = self.game.random.randint(-30,30)
+			self.game.add_object(Explosion.spawn(self.game, (x+self.x+self.width/2, x+self.y+self.height/2), 10))
 		
 		self.game.lives -= 1
-		self.x, self.y = 400, 500
+		self.x, self.y = self.spawn_position()
+		self.prev_x, self.prev_y = self.x, self.y
 		self.invincible = 1500
 		
 		if self.game.lives < 0: 
@@ -340,11 +429,12 @@ class Player(Ship):
 			self.game.show_game_over()
 	
 	def render(self, surface):
-		surface.blit(self.current_frame, (self.x, self.y))
+		sheet, rect = self.game.sprites.frames[self.current_frame]
+		return surface.blit(sheet, (self.x, self.y), rect)
 		
 	def fire(self):
 		if self.can_fire:
-			self.game.add_object(Missile(self, self.game))
+			self.game.projectiles.spawn(self)
 			self.can_fire = False
 
 class Mothership(Ship):
@@ -352,45 +442,51 @@ class Mothership(Ship):
 	def __repr__(self): return "Mothership"
 	def __str__(self): return "Mothership"
 	
+	layer = 'mothership'
+	
+	# shared by every instance, built on first spawn
+	frame = None
+	tint = None
+	
 	def __init__(self, game):
 		Ship.__init__(self, game)		
-		self.current_frame = pygame.image.load('resources/Nightmare.gif').convert()
-		self.width, self.height = self.current_frame.get_size()
+		if Mothership.frame is None: Mothership.load_frame(game.sprites)
+		self.current_frame = self.frame
+		self.width, self.height = game.sprites.size(self.current_frame)
 		self.x, self.y = 0, 20
-		self.fire_interval = 100 + 100*game.difficulty_factor
-		self.max_fire_interval = 5000/game.difficulty
+		balance = game.balance
+		self.fire_interval = balance['fire_interval'] + balance['fire_interval_factor']*game.difficulty_factor
+		self.max_fire_interval = balance['max_fire_interval']/game.difficulty
 		self.current_ticks = 0
-		self.tolerance = 10+game.difficulty
+		self.tolerance = balance['tolerance']+game.difficulty
 		self.hits = 0
-		self.max_hits = int(game.difficulty * 10)
-		self.mask = self.create_mask(self.current_frame.get_colorkey())
-		self.mask.set_alpha(0)
+		self.max_hits = int(game.difficulty * balance['boss_hits'])
+		self.tint_alpha = 0
 		self.x_factor = 0.5 + game.difficulty_factor
 		self.moving_right = True
 		self.moving_down = True
 		
-	def create_mask(self, colorkey=0x000000):
-		surf = pygame.Surface((self.width, self.height))
-		surf.lock()
-		for y in xrange(self.height):
-			for x in xrange(self.width):
-				px = self.current_frame.get_at((x,y))
-				if px == colorkey: surf.set_at((x,y), (0,0,0,0))
-				else: surf.set_at((x,y), (100,0,0,0))
-		surf.unlock()
-		return surf
+	@classmethod
+	def load_frame(cls, sprites):
+		cls.frame = 'Nightmare'
+		cls.hit_mask = sprites.masks[cls.frame]
+		cls.tint = cls.hit_mask.to_surface(setcolor=(100,0,0), unsetcolor=(0,0,0)).convert()
 		
 	def render(self, surface):
-		surface.blit(self.current_frame, (self.x, self.y))
-		surface.blit(self.mask, (self.x, self.y))
+		sheet, frame = self.game.sprites.frames[self.current_frame]
+		rect = surface.blit(sheet, (self.x, self.y), frame)
+		if self.tint_alpha > 0:
+			self.tint.set_alpha(self.tint_alpha)
+			surface.blit(self.tint, (self.x, self.y))
+		return rect
 	
 	def hit(self, hitter):
 		self.hits += 1
-		self.mask.set_alpha((180/self.max_hits*self.hits))
+		self.tint_alpha = 180/self.max_hits*self.hits
 		if self.hits >= self.max_hits:
 			for i in range(5):
-				mag = random.randint(-30, 30)
-				self.game.add_object(Explosion(self.game, (self.x+mag+self.width/2, self.y+mag+self.height/2), abs(mag)))
+				mag = self.game.random.randint(-30, 30)
+				self.game.add_object(Explosion.spawn(self.game, (self.x+mag+self.width/2, self.y+mag+self.height/2), abs(mag)))
 			self.game.score += 1000
 			self.game.remove_object(self)
 			self.game.increase_difficulty()
@@ -402,18 +498,18 @@ class Mothership(Ship):
 		
 		if self.current_ticks > self.fire_interval:
 			self.current_ticks = 0
-			self.fire_interval = random.randint(10, int(self.max_fire_interval))
-			self.game.add_object(Missile(self, self.game, 0.1, 1.1, 1))
+			self.fire_interval = self.game.random.randint(10, int(self.max_fire_interval))
+			self.game.projectiles.spawn(self, 0.1, 1.1, 1)
 			self.color = (0,200,0)
 			
-		self.width, self.height = self.current_frame.get_size()
+		self.width, self.height = self.game.sprites.size(self.current_frame)
 			
 		self.do_movements()
 		
 	def do_movements(self):
 		if self.game.difficulty < 10:
 			# basic figure 8
-			if self.x+self.width/2 >= RESOLUTION[0]: 
+			if self.x+self.width/2 >= self.game.width: 
 				self.moving_right = False
 				self.moving_left = True
 			if self.x <= 0:
@@ -423,152 +519,303 @@ class Mothership(Ship):
 			if self.y <= 0: 
 				self.moving_down = True
 				self.moving_up = False
-			if self.y >= RESOLUTION[1]/2-self.height:
+			if self.y >= self.game.height/2-self.height:
 				self.moving_down = False
 				self.moving_up = True
 		else:
 			# track with the player
 			self.moving_right = self.x+self.width/2 < self.game.player.x+self.game.player.width/2
 			self.moving_left = self.x+self.width/2 > self.game.player.x+self.game.player.width/2
-			self.moving_down = self.game.player.y > 3*RESOLUTION[1]/4 and self.y+self.height < RESOLUTION[1]/3
-			self.moving_up = self.game.player.y < 3*RESOLUTION[1]/4 and self.y > 0
+			self.moving_down = self.game.player.y > 3*self.game.height/4 and self.y+self.height < self.game.height/3
+			self.moving_up = self.game.player.y < 3*self.game.height/4 and self.y > 0
 		
 class Game(object):
 	
-	def __init__(self):
-		self.screen = pygame.display.set_mode(RESOLUTION, FULLSCREEN)
-		pygame.mixer.init()
+	def __init__(self, num_stars=NUM_STARS, dirty_rects=False, max_fps=MAX_FPS, headless=False, profile_frames=PROFILE_FRAMES, record_path=None, render_scale=RENDER_SCALE, balance=None, low_latency=LOW_LATENCY):
+		self.headless = headless
+		self.balance = dict(BALANCE, **(balance or {}))
+		self.width, self.height = RESOLUTION
+		
+		# gameplay and cosmetic effects draw from separate streams so that a
+		# seed and the player's input are enough to reproduce a game
+		self.random = random.Random()
+		self.fx_random = random.Random()
+		self.game_seed = None
+		self.record_path = record_path
+		self.recorder = None
+		
+		# no monitor or audio device: SDL's dummy video driver still gives us a
+		# surface to convert() images against, sounds are stubbed out
+		if headless: os.environ['SDL_VIDEODRIVER'] = 'dummy'
+		self.display = Display(render_scale, fullscreen=not headless)
+		self.screen = self.display.canvas
+		self.view = self.display.view
 		pygame.font.init()
-		self.fps_font = pygame.font.Font(None, 18)
-		self.score_font = pygame.font.Font('resources/century.ttf', 24)
+		self.fps_font = assets.font(None, 18)
+		self.score_font = assets.font('resources/century.ttf', 24)
 		self.float_font = self.fps_font
+		self.text_cache = TextCache()
+		self.fps_digits = GlyphAtlas(self.fps_font, (100,100,100), "0123456789.")
+		self.score_digits = GlyphAtlas(self.score_font, (255,255,255))
 		self.clock = pygame.time.Clock()
+		self.max_fps = max_fps
+		self.frame_start = time.time()
+		self.low_latency = low_latency
+		self.input_latency = InputLatency()
+		self.keys_down = set()
 		
 		self.high_score_table = HighScoreTable()
 		
-		self.current_song = pygame.mixer.Sound('resources/bgm.ogg')
-		self.current_channel = None	
-		self.explosion_sound = pygame.mixer.Sound('resources/explosion.ogg')
-		self.explosion_sound.set_volume(0.4)
-		self.missile_sound = pygame.mixer.Sound('resources/missile.ogg')
-		self.missile_sound.set_volume(0.1)
-		self.one_up_sound = pygame.mixer.Sound('resources/oneup.ogg')
-		self.one_up_sound.set_volume(0.8)
-		
-		missile_image = pygame.image.load('resources/missile00.png').convert()
-		self.missile_image_up = pygame.transform.rotate(missile_image, 90)
-		self.missile_image_down = pygame.transform.rotate(missile_image, -90)
-		
-		self.starfield = Starfield()
+		self.music = MusicPlayer(MUSIC_PLAYLIST, 0.5)
+		
+		# the mixer, sounds and sprites load on a worker thread while the
+		# title screen fades in; setup_game() waits for whatever is left
+		self.startup = {}
+		self.loader = AssetLoader(self.asset_jobs())
+		
+		self.starfield = (ArrayStarfield if numpy else Starfield)(num_stars, self.fx_random, self.display.scale)
+		self.spatial_hashes = dict((layer, SpatialHash()) for layer in TARGET_LAYERS)
+		self.explosion_frames = ExplosionFrames(self.fx_random)
+		self.dirty_renderer = DirtyRenderer(self.display) if dirty_rects else None
+		self.profiler = FrameProfiler(self, profile_frames)
+		
+	def load_sound(self, path):
+		if self.headless: return SilentSound()
+		return assets.sound(path)
+		
+	def asset_jobs(self):
+		# decoding only; converting to the display format stays on the main thread
+		jobs = []
+		if not self.headless: jobs.append(('mixer', pygame.mixer.init))
+		for name, path, volume, priority, voices in SOUNDS: jobs.append((name, lambda path=path: self.load_sound(path)))
+		if ('atlas', tuple(SPRITES)) not in assets.cache: jobs.append(('sprites', lambda: SpriteAtlas.decode(SPRITES)))
+		return jobs
+		
+	def finish_loading(self):
+		if self.loader is None: return
+		loaded = self.loader.wait()
+		self.loader = None
+		
+		self.sounds = SoundScheduler(MAX_VOICES, enabled=not self.headless)
+		for name, path, volume, priority, voices in SOUNDS: self.sounds.add(name, loaded[name], volume, priority=priority, max_voices=voices)
+		self.sprites = assets.get(('atlas', tuple(SPRITES)), lambda: SpriteAtlas(loaded['sprites']))
+		if Mothership.frame is None: Mothership.load_frame(self.sprites)
+		self.projectiles = (ArrayProjectiles if numpy else Projectiles)(self)
+		self.startup.setdefault('interactive', time.time() - START_TIME)
 		
 	def __get_s(self): return self.__score
 	def __set_s(self, score): 
 		self.__score = score
 		if self.__score >= self.next_free_life:
-			self.add_object(FloaterText(self, (self.player.x+self.player.width, self.player.y), "1up"))
+			self.add_object(FloaterText.spawn(self, (self.player.x+self.player.width, self.player.y), "1up"))
 			self.lives += 1
-			self.one_up_sound.play(2)
+			self.sounds.play('oneup', 2)
 			self.next_free_life += 5000
 		
 	score = property(__get_s, __set_s, None, "Score")
 		
-	def setup_game(self):
-		self.player = Player(self)
-		self.objects = set([self.player])
-		self.objects_to_remove = set()
-		self.objects_to_add = set()
+	def reseed(self, seed=None):
+		if seed is None: seed = random.getrandbits(32)
+		self.game_seed = seed
+		self.random.seed(seed)
+		self.fx_random.seed(seed + 1)
+		
+	def setup_game(self, seed=None, players=1):
+		self.finish_loading()
+		self.reseed(seed)
+		# the first player is the one on this machine's keyboard
+		self.num_players = players
+		self.players = [Player(self, slot) for slot in xrange(players)]
+		self.player = self.players[0]
+		self.objects = OrderedSet(self.players)
+		self.layers = dict((layer, OrderedSet()) for layer in LAYERS)
+		self.layers['player'].update(self.players)
+		self.objects_to_remove = OrderedSet()
+		self.objects_to_add = OrderedSet()
 		self.lives = 3
 		self.next_free_life = 5000
 		self.score = 0
 		self.difficulty = 1
-		self.difficulty_factor = 0.1
+		self.difficulty_factor = self.balance['difficulty_factor']
 		self.score_ticks = 0
 		self.score_ticks_max = 500
+		self.accumulator = 0
+		self.interpolation = 1.0
+		self.projectiles.clear()
+		self.input_latency.clear()
+		self.sync_keys()
+		self.clock.tick()
+		if self.dirty_renderer: self.dirty_renderer.invalidate()
 			
 	def handle_input(self):
 		
-		events = pygame.event.get()
-		
-		for e in events:
+		tapped = set()
+		for stamp, e in self.input_latency.take():
 			if e.type == QUIT: self.main_loop_done = True
-			elif e.type == KEYDOWN: self.handle_keypress(e.key)
+			elif e.type == KEYDOWN:
+				if e.key in CONTROL_KEYS:
+					self.input_latency.handled(stamp)
+					self.keys_down.add(e.key)
+					tapped.add(e.key)
+				self.handle_keypress(e.key)
+			elif e.type == KEYUP: self.keys_down.discard(e.key)
+			elif e.type == MUSIC_END: self.music.track_ended()
 
-		keys = pygame.key.get_pressed()
+		# the events' view of the keys: a key pressed and released again
+		# since the last frame still counts for this one
+		if self.low_latency: keys = collections.defaultdict(bool, ((key, True) for key in self.keys_down | tapped))
+		else: keys = pygame.key.get_pressed()
 		
 		self.player.moving_left = keys[K_LEFT]
 		self.player.moving_right = keys[K_RIGHT]
 		self.player.moving_up = keys[K_UP]
 		self.player.moving_down = keys[K_DOWN]
 		
-		if keys[K_SPACE]: self.handle_space_key()
+		self.player.firing = keys[K_SPACE]
 		
 	def handle_keypress(self, key):
 		
 		if key == K_ESCAPE:
 			option = TitleScreen(self, 255, False).run()
 			if option == 'quit': self.main_loop_done = True
+			if self.dirty_renderer: self.dirty_renderer.invalidate()
+			# the menu ate any key releases
+			self.sync_keys()
+			self.clock.tick()
+		elif key == K_F3: self.profiler.visible = not self.profiler.visible
+		elif key == K_F4: self.profiler.capture()
 			
-	def handle_space_key(self):	self.player.fire()
-
 	def increase_difficulty(self):
 		self.difficulty += self.difficulty_factor
-		self.difficulty_factor += 0.1
+		self.difficulty_factor += self.balance['difficulty_ramp']
 		self.score_ticks_max -= self.difficulty
 		self.score_ticks_max = max(50, self.score_ticks_max)
 
-	def update(self):
-		ticks = self.clock.tick(30)
+	def sync_keys(self):
+		pressed = pygame.key.get_pressed()
+		self.keys_down = set(key for key in CONTROL_KEYS if pressed[key])
+		
+	def wait_for_frame(self):
+		# the frame cap's sleep, spent blocked in the event queue so that
+		# keypresses are stamped when they arrive rather than when next polled
+		if self.max_fps:
+			deadline = self.frame_start + 1.0 / self.max_fps
+			left = deadline - time.time()
+			while left > 0:
+				self.input_latency.collect(wait_events(max(1, int(left * 1000))))
+				left = deadline - time.time()
+		self.frame_start = time.time()
+		return self.clock.tick()
+		
+	def update(self, ticks=None):
+		if ticks is None: ticks = self.wait_for_frame()
+		
+		# run as many fixed steps as the elapsed time covers; the leftover
+		# fraction of a step is used to interpolate positions when rendering
+		self.accumulator += min(ticks, MAX_FRAME_TIME)
+		while self.accumulator >= SIM_STEP and not self.main_loop_done:
+			self.step(SIM_STEP)
+			self.accumulator -= SIM_STEP
+			
+		self.interpolation = min(1.0, self.accumulator / SIM_STEP)
+		
+	def step(self, ticks):
+		if self.recorder: self.recorder.record(self.player)
 		
 		self.score_ticks += ticks
 		if self.score_ticks > self.score_ticks_max:
 			self.score_ticks = 0
 			self.score += 1
 	
-		for obj in self.objects_to_add: self.objects.add(obj)
-		self.objects_to_add = set()
+		for obj in self.objects_to_add: 
+			self.objects.add(obj)
+			self.layers[obj.layer].add(obj)
+		self.objects_to_add.clear()
+		
+		for obj in self.objects_to_remove: 
+			self.objects.remove(obj)
+			self.layers[obj.layer].remove(obj)
+			obj.release()
+		self.objects_to_remove.clear()
+		self.projectiles.begin_step()
 		
-		for obj in self.objects_to_remove: self.objects.remove(obj)
-		self.objects_to_remove = set()
+		for layer, spatial_hash in self.spatial_hashes.items(): spatial_hash.rebuild(self.layers[layer])
 		
 		self.starfield.update(ticks)
 		
-		found_mothership = False
-		for object in self.objects: 
-			object.update(ticks)
-			if isinstance(object, Mothership): found_mothership = True
+		for object in self.objects: object.prev_x, object.prev_y = object.x, object.y
+		
+		# targets' buckets follow them as they move, so a query sees where they
+		# are now whichever order the objects update in
+		spatial_hashes = self.spatial_hashes
+		for object in self.objects:
+			spatial_hash = spatial_hashes.get(object.layer)
+			if spatial_hash is None: object.update(ticks)
+			else:
+				box = object.x, object.y, object.width, object.height
+				object.update(ticks)
+				spatial_hash.move(object, box)
+		self.projectiles.update(ticks)
 			
-		if not found_mothership: self.add_object(Mothership(self))
+		if not self.layers['mothership']: self.add_object(Mothership(self))
 		
 	def add_object(self, object): self.objects_to_add.add(object)
 	
 	def remove_object(self, object):
 		if object in self.objects: self.objects_to_remove.add(object)
+		
+	def objects_at(self, layer, x, y):
+		if layer in PROJECTILE_LAYERS: return self.projectiles.at_point(layer, x, y)
+		return self.spatial_hashes[layer].query(x, y)
 	
 	def render(self):
+		dirty = self.dirty_renderer
+		view = self.view
+		
+		alpha = self.interpolation
 		
-		self.starfield.render(self.screen)
+		self.starfield.render(self.screen, alpha)
+		if dirty: self.starfield.mark_dirty(dirty)
 		
-		for object in self.objects: object.render(self.screen)
+		for rect in self.projectiles.render(view, alpha):
+			if dirty: dirty.add_rect(rect)
+		
+		for object in self.objects: 
+			x, y = object.x, object.y
+			object.x, object.y = object.interpolated_position(alpha)
+			rect = object.render(view)
+			object.x, object.y = x, y
+			if dirty: dirty.add_rect(rect)
 		
-		fps = self.fps_font.render("fps: %.2f" % self.clock.get_fps(), True, (100,100,100))
-		self.screen.blit(fps, (0,0))
+		fps = self.text_cache.render(self.fps_font, "fps: ", (100,100,100))
+		view.blit(fps, (0,0))
+		fps_end = self.fps_digits.render(view, "%.2f" % self.clock.get_fps(), (fps.get_width(), 0))
 		
-		score = self.score_font.render("Score: %d" % self.score, True, (255,255,255))
-		self.screen.blit(score, (self.screen.get_width()-score.get_width()-10, 10))
+		score = self.text_cache.render(self.score_font, "Score: ", (255,255,255))
+		score_digits = "%d" % self.score
+		score_x = self.width-score.get_width()-self.score_digits.get_width(score_digits)-10
+		view.blit(score, (score_x, 10))
+		self.score_digits.render(view, score_digits, (score_x+score.get_width(), 10))
 		
-		lives = self.score_font.render("Lives: %d" % self.lives, True, (255,255,255))
-		self.screen.blit(lives, (self.screen.get_width()-score.get_width()-10, 35))
+		lives = self.text_cache.render(self.score_font, "Lives: %d" % self.lives, (255,255,255))
+		view.blit(lives, (score_x, 35))
+		
+		if dirty:
+			dirty.add_rect(self.display.to_canvas((0, 0, fps_end, fps.get_height())))
+			dirty.add_rect(self.display.to_canvas((score_x, 10, self.width-score_x, 35+lives.get_height()-10)))
 		
 		#speed = self.fps_font.render("Speed: %f" % self.player.x_speed, True, (100,100,100))
 		#self.screen.blit(speed, (0, 20))
 				
 	def show_game_over(self):
 		
+		if self.headless:
+			self.main_loop_done = True
+			return
+		
 		self.render()
-		last_scene = pygame.Surface(RESOLUTION)
-		last_scene.blit(self.screen, (0,0))
 		
-		fade_over_surface = pygame.Surface(RESOLUTION).convert_alpha()
+		fade_over_surface = pygame.Surface(self.screen.get_size()).convert_alpha()
 		fade_over_surface.fill((0,0,0,100))
 		
 		game_over_text = self.score_font.render("Game Over", True, (255,255,255))
@@ -579,30 +826,33 @@ class Game(object):
 		ty = (game_over_box.get_height() - game_over_text.get_height()) / 2
 		game_over_box.blit(game_over_text, (tx, ty))
 		
-		x = (RESOLUTION[0] - game_over_box.get_width()) / 2
-		y = (RESOLUTION[1] - game_over_box.get_height()) / 2
+		x = (self.width - game_over_box.get_width()) / 2
+		y = (self.height - game_over_box.get_height()) / 2
+		
+		self.screen.blit(fade_over_surface, (0,0))
+		self.view.blit(game_over_box, (x,y))
+		last_scene = self.screen.copy()
 		
 		done = False
+		redraw = True
 		while not done:
-			events = pygame.event.get()
-			for e in events:
-				if e.type == KEYDOWN and e.key == K_ESCAPE: done = True
+			if redraw:
+				self.screen.blit(last_scene, (0,0))
+				self.display.present()
+				redraw = False
 			
-			self.screen.blit(last_scene, (0,0))
-			self.screen.blit(fade_over_surface, (0,0))
-			self.screen.blit(game_over_box, (x,y))
-			
-			pygame.display.flip()
-			pygame.time.delay(50)
+			for e in wait_events(IDLE_WAIT):
+				if e.type == KEYDOWN and e.key == K_ESCAPE: done = True
+				elif e.type == VIDEOEXPOSE: redraw = True
+				elif e.type == MUSIC_END: self.music.track_ended()
 			
-		if self.high_score_table.is_high_score(self.score): self.high_score_table.new_score_entry(self.screen, self.score)
+		if self.high_score_table.is_high_score(self.score): self.high_score_table.new_score_entry(self.view, self.score, self.display.present)
 		
 		self.main_loop_done = True
 		
-	def music_update(self):
-		if self.current_channel is None or not self.current_channel.get_busy():
-			self.current_channel = self.current_song.play()
-			self.current_channel.set_volume(0.5)
+	def music_update(self): 
+		self.music.update()
+		self.sounds.flush()
 		
 	def run(self):
 		pygame.mouse.set_visible(False)
@@ -614,128 +864,1499 @@ class Game(object):
 			alpha = 255
 			if option == 'highscores':
 				done = False
+				redraw = True
 				while not done:
-					events = pygame.event.get()
-					for e in events:
+					if redraw:
+						self.high_score_table.render(self.view)
+						self.display.present()
+						redraw = False
+					
+					for e in wait_events(IDLE_WAIT):
 						if e.type == KEYDOWN and e.key == K_ESCAPE: done = True
-					self.screen.fill((0,0,0))
-					self.high_score_table.render(self.screen)
-					pygame.display.flip()
-					pygame.time.delay(50)
+						elif e.type == KEYDOWN and e.key in (K_LEFT, K_RIGHT):
+							self.high_score_table.toggle_board()
+							redraw = True
+						elif e.type == VIDEOEXPOSE: redraw = True
+						elif e.type == MUSIC_END: self.music.track_ended()
 			elif option == 'quit': all_done = True
-			elif option == 'play':				
-				self.main_loop_done = False if option == 'play' else True
-				self.setup_game()
-				while not self.main_loop_done:
-					self.handle_input()
-					self.update()
-					self.music_update()
-					self.render()
+			elif option == 'play': self.play()
+				
+		pygame.mouse.set_visible(True)
+		
+	def play(self, players=1):
+		self.main_loop_done = False
+		self.setup_game(players=players)
+		# recordings only carry the local player's input
+		if self.record_path and players == 1: self.recorder = InputRecorder(self.game_seed)
+		profiler = self.profiler
+		while not self.main_loop_done:
+			profiler.start_frame()
+			ticks = self.wait_for_frame() if self.low_latency else None
+			self.handle_input()
+			profiler.mark('input')
+			self.update(ticks)
+			profiler.mark('update')
+			self.music_update()
+			profiler.mark('music')
+			self.render()
+			profiler.render(self.screen)
+			profiler.mark('render')
+			
+			if self.dirty_renderer: self.dirty_renderer.present()
+			else:
+				self.display.present()
+				self.screen.fill((0,0,0))
+			self.input_latency.presented()
+			profiler.mark('flip')
+			profiler.end_frame()
+	
+		self.high_score_table.save_high_scores()
+		if self.recorder:
+			self.recorder.save(self.record_path, self)
+			self.recorder = None
+		
+	def run_headless(self, frames, pilot=None, seed=None):
+		# steps the simulation as fast as possible, without rendering, starting
+		# a new game whenever the pilot loses; returns throughput figures
+		pilot = pilot or RandomPilot(seed)
+		frame = 0
+		games = 0
+		
+		start = time.time()
+		while frame < frames:
+			self.main_loop_done = False
+			self.setup_game(None if seed is None else seed + games)
+			games += 1
+			while frame < frames and not self.main_loop_done:
+				pilot(self, frame)
+				self.step(SIM_STEP)
+				frame += 1
+		seconds = max(time.time() - start, 1e-9)
+		
+		return {'frames': frames, 'games': games, 'seconds': seconds, 'fps': frames / seconds}
+		
+	def replay(self, recording):
+		# re-runs a recorded game step by step with rendering skipped
+		self.main_loop_done = False
+		self.setup_game(recording.seed)
+		
+		steps = 0
+		start = time.time()
+		for bits in recording.inputs():
+			if self.main_loop_done: break
+			apply_input_bits(self.player, bits)
+			self.step(SIM_STEP)
+			steps += 1
+		seconds = max(time.time() - start, 1e-9)
+		
+		return {'steps': steps, 'score': self.score, 'lives': self.lives, 'seconds': seconds, 'fps': steps / seconds}
+
+class FrameProfiler(object):
+	
+	# per-phase frame timings shown as an overlay (F3), and cProfile
+	# captures of the next few frames written to disk (F4)
+	
+	phases = ['input', 'update', 'music', 'render', 'flip']
+	colors = {'input': (0,150,255), 'update': (0,200,0), 'music': (200,0,200), 'render': (255,150,0), 'flip': (200,200,200)}
+	history = 120
+	graph_height = 60
+	graph_scale = 1.0 # pixels per millisecond
+	
+	def __init__(self, game, profile_frames=PROFILE_FRAMES):
+		self.game = game
+		self.profile_frames = profile_frames
+		self.visible = False
+		self.timings = dict((phase, collections.deque([0.0]*self.history, self.history)) for phase in self.phases)
+		self.current = {}
+		self.profile = None
+		self.profile_frames_left = 0
+		self.last_file = None
+		
+	def start_frame(self):
+		if self.profile_frames_left > 0: self.profile.enable()
+		self.current.clear()
+		self.last = time.time()
+		
+	def mark(self, phase):
+		now = time.time()
+		self.current[phase] = self.current.get(phase, 0.0) + (now - self.last) * 1000.0
+		self.last = now
+		
+	def end_frame(self):
+		for phase in self.phases: self.timings[phase].append(self.current.get(phase, 0.0))
+		
+		if self.profile_frames_left > 0:
+			self.profile.disable()
+			self.profile_frames_left -= 1
+			if self.profile_frames_left == 0:
+				self.last_file = time.strftime('profile-%Y%m%d-%H%M%S.prof')
+				self.profile.dump_stats(self.last_file)
+				self.profile = None
+				
+	def capture(self, frames=None):
+		if self.profile_frames_left > 0: return
+		self.profile = cProfile.Profile()
+		self.profile_frames_left = frames or self.profile_frames
+		
+	def render(self, surface):
+		if not self.visible: return
+		
+		font = self.game.fps_font
+		lines = []
+		for phase in self.phases:
+			samples = self.timings[phase]
+			lines.append(("%-7s %6.2fms  max %6.2fms" % (phase, sum(samples) / len(samples), max(samples)), self.colors[phase]))
+			
+		counts = collections.Counter(type(object).__name__ for object in self.game.objects)
+		lines.append(("objects: %d  " % len(self.game.objects) + "  ".join("%s %d" % item for item in sorted(counts.items())), (200,200,200)))
+		# the collector's thresholds count net container allocations, not all of
+		# them, and each generation's count restarts when it is collected
+		lines.append(("gc pending: gen0 %d  gen1 %d  gen2 %d" % gc.get_count(), (200,200,200)))
+		sounds = self.game.sounds
+		lines.append(("voices: %d/%d  played %d  coalesced %d  dropped %d  stolen %d" % (len(sounds.voices), sounds.max_voices, sounds.played, sounds.coalesced, sounds.dropped, sounds.stolen), (200,200,200)))
+		lines.append(("assets: %d loaded, %d hits, %d misses" % (len(assets.cache), assets.hits, assets.misses), (200,200,200)))
+		lines.append(("input to present: " + ("low latency  " if self.game.low_latency else "") + self.game.input_latency.summary(), (200,200,200)))
+		lines.append(("startup: " + "  ".join("%s %.0fms" % (name, seconds * 1000.0) for name, seconds in sorted(self.game.startup.items())), (200,200,200)))
+		if self.profile_frames_left > 0: lines.append(("profiling, %d frames left" % self.profile_frames_left, (255,0,0)))
+		elif self.last_file: lines.append(("saved " + self.last_file, (200,200,200)))
+		
+		line_height = font.get_linesize()
+		width = max(280, self.history * 2)
+		height = len(lines) * line_height + self.graph_height + 10
+		x, y = 0, 20
+		
+		panel = pygame.Surface((width, height))
+		panel.set_alpha(200)
+		
+		ty = 0
+		for text, color in lines:
+			panel.blit(font.render(text, False, color), (4, ty))
+			ty += line_height
+			
+		# stacked bars, newest frame on the right, with a line at one simulation step
+		base = height - 4
+		for i in xrange(self.history):
+			bottom = base
+			for phase in self.phases:
+				h = self.timings[phase][i] * self.graph_scale
+				if h >= 1:
+					pygame.draw.line(panel, self.colors[phase], (i*2, bottom), (i*2, max(bottom-h, base-self.graph_height)))
+					bottom -= h
+		step_y = base - SIM_STEP * self.graph_scale
+		pygame.draw.line(panel, (255,0,0), (0, step_y), (width, step_y))
+		
+		rect = surface.blit(panel, (x, y))
+		if self.game.dirty_renderer: self.game.dirty_renderer.add_rect(rect)
+
+class InputLatency(object):
+	
+	# events drained from SDL's queue early wait here with the time they were
+	# seen, and every steering keypress is timed until the frame it went into
+	# is presented
+	
+	history = 1000
+	
+	def __init__(self):
+		self.queued = []
+		self.unpresented = []
+		self.samples = collections.deque(maxlen=self.history)
+		
+	def clear(self):
+		self.queued = []
+		self.unpresented = []
+		
+	def collect(self, events=None):
+		now = time.time()
+		if events is None: events = pygame.event.get()
+		self.queued.extend((now, e) for e in events)
+		
+	def take(self):
+		# (stamp, event) for everything seen so far, oldest first
+		self.collect()
+		events, self.queued = self.queued, []
+		return events
+		
+	def handled(self, stamp): self.unpresented.append(stamp)
+	
+	def presented(self):
+		now = time.time()
+		self.samples.extend(now - stamp for stamp in self.unpresented)
+		self.unpresented = []
+		
+	def summary(self):
+		if not self.samples: return "no keypresses yet"
+		return "p50 %.1fms  p99 %.1fms  over %d keypresses" % (percentile(self.samples, 0.5) * 1000.0, percentile(self.samples, 0.99) * 1000.0, len(self.samples))
+
+class AssetCache(object):
+	
+	# images, fonts and sounds are loaded (and converted) once per process
+	# and shared from then on
+	
+	def __init__(self):
+		self.cache = {}
+		self.hits = 0
+		self.misses = 0
+		
+	def get(self, key, load):
+		asset = self.cache.get(key)
+		if asset is None:
+			self.misses += 1
+			asset = self.cache[key] = load()
+		else: self.hits += 1
+		return asset
+		
+	def font(self, path, size): return self.get(('font', path, size), lambda: pygame.font.Font(path, size))
+	
+	def sound(self, path): return self.get(('sound', path), lambda: pygame.mixer.Sound(path))
+	
+assets = AssetCache()
+
+class SpriteAtlas(object):
+	
+	# sprites packed onto a few display format sheets, so each is decoded and
+	# converted once and frames blit from a shared surface by rect.
+	# transparent pixels are remapped to one colorkey. large sprites go on an
+	# RLE accelerated sheet so blits skip their transparent runs; small ones
+	# (missiles) on a plain keyed sheet, since an RLE area blit has to walk
+	# every row above its rect. per-pixel alpha sprites get their own sheet.
+	# never blit through subsurfaces of an RLE sheet, SDL re-encodes the
+	# parent on every such blit
+	
+	key = (255, 0, 255)
+	
+	def __init__(self, sprites, width=256, padding=1, rle_area=64*64):
+		self.frames = {}
+		self.masks = {}
+		
+		sheets = {}
+		for name, image in sprites:
+			w, h = image.get_size()
+			if image.get_flags() & SRCALPHA: kind = 'alpha'
+			elif w * h >= rle_area: kind = 'rle'
+			else: kind = 'keyed'
+			sheets.setdefault(kind, []).append((name, image))
+		for kind, group in sheets.items(): self.pack(group, width, padding, kind)
+		
+		for name, image in sprites: self.masks[name] = pygame.mask.from_surface(image)
+		
+	@classmethod
+	def load(cls, paths): return cls(cls.decode(paths))
+		
+	@staticmethod
+	def decode(paths):
+		sprites = []
+		for path in paths:
+			name = os.path.splitext(os.path.basename(path))[0]
+			image = pygame.image.load(path)
+			if name == 'missile00':
+				# missiles fly both ways
+				sprites.append(('missile_up', pygame.transform.rotate(image, 90)))
+				sprites.append(('missile_down', pygame.transform.rotate(image, -90)))
+			else: sprites.append((name, image))
+		return sprites
+		
+	def pack(self, sprites, width, padding, kind):
+		# shelf packing, tallest first
+		sprites = sorted(sprites, key=lambda sprite: -sprite[1].get_height())
+		width = max([width] + [image.get_width() + padding for name, image in sprites])
+		
+		rects = []
+		x = y = shelf = 0
+		for name, image in sprites:
+			w, h = image.get_size()
+			if x + w > width: x, y, shelf = 0, y + shelf + padding, 0
+			rects.append((name, image, pygame.Rect(x, y, w, h)))
+			x += w + padding
+			shelf = max(shelf, h)
+			
+		if kind == 'alpha':
+			sheet = pygame.Surface((width, y + shelf), SRCALPHA).convert_alpha()
+			sheet.fill((0, 0, 0, 0))
+		else:
+			sheet = pygame.Surface((width, y + shelf)).convert()
+			sheet.fill(self.key)
+			
+		for name, image, rect in rects:
+			sheet.blit(image, rect)
+			self.frames[name] = (sheet, rect)
+			
+		if kind == 'rle': sheet.set_colorkey(self.key, RLEACCEL)
+		elif kind == 'keyed': sheet.set_colorkey(self.key)
+		
+	def size(self, name): return self.frames[name][1].size
+
+class AssetLoader(object):
+	
+	# runs (name, load) jobs in order on a worker thread and posts
+	# ASSETS_LOADED when done. wait() hands over the results, or re-raises
+	# what a job raised, on the calling thread
+	
+	def __init__(self, jobs):
+		self.jobs = jobs
+		self.loaded = {}
+		self.error = None
+		self.thread = threading.Thread(target=self.work)
+		self.thread.daemon = True
+		self.thread.start()
+		
+	def work(self):
+		try:
+			for name, load in self.jobs: self.loaded[name] = load()
+		except Exception: self.error = sys.exc_info()
+		pygame.event.post(pygame.event.Event(ASSETS_LOADED))
+		
+	def wait(self):
+		self.thread.join()
+		if self.error: raise self.error[0], self.error[1], self.error[2]
+		return self.loaded
+
+class MusicPlayer(object):
+	
+	# streams the playlist through pygame.mixer.music rather than decoding
+	# whole tracks into memory; a single track loops gaplessly inside the
+	# mixer, longer playlists queue the next track while the current one plays
+	
+	def __init__(self, playlist=(), volume=0.5, loop=True):
+		self.playlist = list(playlist)
+		self.volume = volume
+		self.loop = loop
+		self.index = 0
+		self.queued = None
+		self.playing = False
+		self.finished = False
+		
+	def add(self, path): self.playlist.append(path)
+	
+	def next_index(self, index):
+		index += 1
+		if index < len(self.playlist): return index
+		return 0 if self.loop else None
+		
+	def play(self, index=0):
+		if not self.playlist: return
+		
+		self.index = index
+		self.queued = None
+		pygame.mixer.music.set_endevent(MUSIC_END)
+		pygame.mixer.music.load(self.playlist[index])
+		pygame.mixer.music.set_volume(self.volume)
+		
+		if len(self.playlist) == 1: pygame.mixer.music.play(-1 if self.loop else 0)
+		else:
+			pygame.mixer.music.play()
+			self.queue_next()
+			
+		self.playing = True
+		self.finished = False
+		
+	def queue_next(self):
+		self.queued = self.next_index(self.index)
+		if self.queued is not None: pygame.mixer.music.queue(self.playlist[self.queued])
+		
+	def track_ended(self):
+		# posted by the mixer when a track finishes and the queued one takes over
+		if not self.playing: return
+		if self.queued is None:
+			self.playing = False
+			self.finished = True
+		else:
+			self.index = self.queued
+			self.queue_next()
+			
+	def skip(self):
+		index = self.next_index(self.index)
+		if index is None: self.stop()
+		else: self.play(index)
+		
+	def stop(self):
+		pygame.mixer.music.stop()
+		self.playing = False
+		
+	def set_volume(self, volume):
+		self.volume = volume
+		if self.playing: pygame.mixer.music.set_volume(volume)
+		
+	def update(self):
+		if self.finished: return
+		if not self.playing: self.play()
+		# the end event can be eaten by a menu's event loop; if the mixer ran
+		# dry without us queueing the next track, carry on from there
+		elif not pygame.mixer.music.get_busy(): self.skip()
+
+class SoundScheduler(object):
+	
+	# sound effects are requested during the frame and started together in
+	# flush(): identical requests in one frame play once, each sound has its
+	# own voice limit and when every channel is busy a lower priority voice
+	# is cut to make room
+	
+	class Voice(object):
+		
+		def __init__(self, channel, name, priority):
+			self.channel = channel
+			self.name = name
+			self.priority = priority
+	
+	def __init__(self, max_voices=MAX_VOICES, enabled=True):
+		self.max_voices = max_voices
+		self.enabled = enabled
+		self.sounds = {}
+		self.pending = {}
+		self.voices = []
+		self.played = self.coalesced = self.dropped = self.stolen = 0
+		if enabled: pygame.mixer.set_num_channels(max_voices)
+		
+	def add(self, name, sound, volume=1.0, priority=0, max_voices=2):
+		sound.set_volume(volume)
+		self.sounds[name] = (sound, priority, max_voices)
+		
+	def play(self, name, loops=0):
+		if name in self.pending:
+			self.coalesced += 1
+			loops = max(loops, self.pending[name])
+		self.pending[name] = loops
+		
+	def usage(self):
+		counts = collections.Counter(voice.name for voice in self.voices)
+		return len(self.voices), dict(counts)
+		
+	def steal(self, voices):
+		# oldest voice of the lowest priority
+		victim = min(voices, key=lambda voice: voice.priority)
+		self.voices.remove(victim)
+		victim.channel.stop()
+		self.stolen += 1
+		return victim.channel
+		
+	def flush(self):
+		if not self.enabled or not self.pending:
+			self.pending.clear()
+			return
+			
+		self.voices = [voice for voice in self.voices if voice.channel.get_busy()]
+		
+		for name, loops in sorted(self.pending.items(), key=lambda item: -self.sounds[item[0]][1]):
+			sound, priority, max_voices = self.sounds[name]
+			same = [voice for voice in self.voices if voice.name == name]
+			
+			if len(same) >= max_voices: channel = self.steal(same)
+			elif len(self.voices) >= self.max_voices:
+				lower = [voice for voice in self.voices if voice.priority < priority]
+				channel = self.steal(lower) if lower else None
+			else: channel = pygame.mixer.find_channel()
+			
+			if channel is None:
+				self.dropped += 1
+				continue
+				
+			channel.play(sound, loops)
+			self.voices.append(self.Voice(channel, name, priority))
+			self.played += 1
+			
+		self.pending.clear()
+
+class SilentSound(object):
+	
+	def play(self, *args): return None
+	def set_volume(self, volume): pass
+
+class OrderedSet(collections.OrderedDict):
+	
+	# a set that iterates in insertion order, so the update order of game
+	# objects (and with it every random draw) is the same on every run
+	
+	def __init__(self, items=()):
+		collections.OrderedDict.__init__(self)
+		for item in items: self[item] = None
+		
+	def add(self, item): self[item] = None
+	def remove(self, item): del self[item]
+	def discard(self, item): self.pop(item, None)
+	
+	def update(self, items):
+		for item in items: self[item] = None
+
+INPUT_BITS = (('moving_left', 1), ('moving_right', 2), ('moving_up', 4), ('moving_down', 8), ('firing', 16))
+
+def input_bits(player):
+	bits = 0
+	for name, bit in INPUT_BITS:
+		if getattr(player, name): bits |= bit
+	return bits
+	
+def apply_input_bits(player, bits):
+	for name, bit in INPUT_BITS: setattr(player, name, bool(bits & bit))
+
+class InputRecorder(object):
+	
+	# the player's input for every simulation step, run-length encoded as
+	# (count, bits) pairs; with the game's seed this reproduces the game.
+	# file layout: magic, version, seed, steps, score, lives, run count, runs.
+	# the version goes up whenever the simulation changes under old recordings
+	# (2: missiles moved into Projectiles storage)
+	
+	magic = 'MSRC'
+	version = 2
+	header = struct.Struct('<4sBIIiiI')
+	run = struct.Struct('<HB')
+	
+	def __init__(self, seed):
+		self.seed = seed
+		self.runs = []
+		self.steps = 0
+		
+	def record(self, player):
+		bits = input_bits(player)
+		if self.runs and self.runs[-1][1] == bits and self.runs[-1][0] < 0xffff: self.runs[-1][0] += 1
+		else: self.runs.append([1, bits])
+		self.steps += 1
+		
+	def save(self, path, game):
+		f = open(path, 'wb')
+		f.write(self.header.pack(self.magic, self.version, self.seed, self.steps, game.score, game.lives, len(self.runs)))
+		for count, bits in self.runs: f.write(self.run.pack(count, bits))
+		f.close()
+
+class InputRecording(object):
+	
+	def __init__(self, seed, runs, steps, score, lives):
+		self.seed = seed
+		self.runs = runs
+		self.steps = steps
+		self.score = score
+		self.lives = lives
+		
+	@classmethod
+	def load(cls, path):
+		f = open(path, 'rb')
+		data = f.read()
+		f.close()
+		
+		header = InputRecorder.header
+		magic, version, seed, steps, score, lives, num_runs = header.unpack_from(data, 0)
+		if magic != InputRecorder.magic: raise ValueError("%s is not a recording" % path)
+		if version != InputRecorder.version: raise ValueError("%s is a version %d recording, this game replays version %d" % (path, version, InputRecorder.version))
+		
+		run = InputRecorder.run
+		runs = [run.unpack_from(data, header.size + i * run.size) for i in xrange(num_runs)]
+		return cls(seed, runs, steps, score, lives)
+		
+	def inputs(self):
+		for count, bits in self.runs:
+			for i in xrange(count): yield bits
+			
+	def matches(self, result):
+		return result['steps'] == self.steps and result['score'] == self.score and result['lives'] == self.lives
+
+class RandomPilot(object):
+	
+	# holds a random direction for a while and fires at random
+	
+	def __init__(self, seed=None, hold=15, fire_chance=0.5):
+		self.random = random.Random(seed)
+		self.hold = hold
+		self.fire_chance = fire_chance
+		self.keys = set()
+		
+	def __call__(self, game, frame):
+		if frame % self.hold == 0:
+			self.keys = set([self.random.choice(['left', 'right', None]), self.random.choice(['up', 'down', None, None])])
+			if self.random.random() < self.fire_chance: self.keys.add('fire')
+		apply_pilot_keys(game, self.keys)
+
+class AutoPilot(object):
+	
+	# fires constantly, stays under the boss and sidesteps enemy missiles
+	# that are about to come down on the player
+	
+	def __init__(self, danger=120, slack=10):
+		self.danger = danger
+		self.slack = slack
+		
+	def __call__(self, game, frame):
+		player = game.player
+		cx = player.x + player.width/2
+		keys = set(['fire'])
+		
+		threat = None
+		for x, y, width, height in game.projectiles.boxes('enemy_missile'):
+			if 0 < player.y - y < self.danger and abs(x + width/2 - cx) < player.width:
+				threat = x + width/2
+				break
+		
+		if threat is not None: keys.add('left' if threat > cx else 'right')
+		else:
+			for boss in game.layers['mothership']:
+				bx = boss.x + boss.width/2
+				if bx < cx - self.slack: keys.add('left')
+				elif bx > cx + self.slack: keys.add('right')
+				break
+		apply_pilot_keys(game, keys)
+
+class ScriptedPilot(object):
+	
+	# replays a looping list of (frames, keys) pairs, read from lines like
+	# "30 left fire" when loaded from a file
+	
+	def __init__(self, script):
+		self.script = script
+		self.length = sum(frames for frames, keys in script)
+		
+	@classmethod
+	def load(cls, path):
+		script = []
+		f = open(path, 'r')
+		for line in f:
+			parts = line.split()
+			if parts and not parts[0].startswith('#'): script.append((int(parts[0]), set(parts[1:])))
+		f.close()
+		return cls(script)
+		
+	def __call__(self, game, frame):
+		frame %= self.length
+		for frames, keys in self.script:
+			if frame < frames: break
+			frame -= frames
+		apply_pilot_keys(game, keys)
+
+def apply_pilot_keys(game, keys):
+	game.player.moving_left = 'left' in keys
+	game.player.moving_right = 'right' in keys
+	game.player.moving_up = 'up' in keys
+	game.player.moving_down = 'down' in keys
+	game.player.firing = 'fire' in keys
+
+class SpatialHash(object):
+	
+	def __init__(self, cell_size=64):
+		self.cell_size = cell_size
+		self.cells = {}
+		
+	def cell_range(self, x, y, width, height):
+		cs = self.cell_size
+		return int(x // cs), int(y // cs), int((x+width) // cs), int((y+height) // cs)
+		
+	def clear(self): self.cells.clear()
+	
+	def insert(self, object):
+		x0, y0, x1, y1 = self.cell_range(object.x, object.y, object.width, object.height)
+		cells = self.cells
+		for cx in xrange(x0, x1+1):
+			for cy in xrange(y0, y1+1):
+				bucket = cells.get((cx,cy))
+				if bucket is None: cells[(cx,cy)] = [object]
+				else: bucket.append(object)
+				
+	def remove(self, object, (x0, y0, x1, y1)):
+		cells = self.cells
+		for cx in xrange(x0, x1+1):
+			for cy in xrange(y0, y1+1):
+				bucket = cells.get((cx,cy))
+				if bucket is None or object not in bucket: continue
+				bucket.remove(object)
+				if not bucket: del cells[(cx,cy)]
+				
+	def move(self, object, (x, y, width, height)):
+		# re-buckets an object that was inserted with the given box
+		old = self.cell_range(x, y, width, height)
+		if old == self.cell_range(object.x, object.y, object.width, object.height): return
+		self.remove(object, old)
+		self.insert(object)
+				
+	def rebuild(self, objects):
+		self.cells.clear()
+		for object in objects: self.insert(object)
+		
+	def query(self, x, y, width=0, height=0):
+		x0, y0, x1, y1 = self.cell_range(x, y, width, height)
+		if x0 == x1 and y0 == y1: return self.cells.get((x0,y0), ())
+		
+		found = set()
+		for cx in xrange(x0, x1+1):
+			for cy in xrange(y0, y1+1):
+				bucket = self.cells.get((cx,cy))
+				if bucket: found.update(bucket)
+		return found
+
+class Projectiles(object):
+	
+	# every missile in flight, one row each instead of one object each.
+	# missiles fired during a step join at the start of the next one and hit
+	# ones are dropped there, like objects passed to add/remove_object. all
+	# missiles move first, then each tests the targets' current positions and
+	# hits are applied in firing order. ArrayProjectiles does the same with
+	# numpy arrays, for bullet-hell numbers of missiles
+	
+	layers = PROJECTILE_LAYERS
+	
+	def __init__(self, game):
+		self.game = game
+		self.frames = {-1: game.sprites.frames['missile_up'], 1: game.sprites.frames['missile_down']}
+		self.masks = {-1: game.sprites.masks['missile_up'], 1: game.sprites.masks['missile_down']}
+		self.sizes = dict((direction, rect.size) for direction, (sheet, rect) in self.frames.items())
+		self.column_width = max(width for width, height in self.sizes.values())
+		self.clear()
+		
+	def clear(self):
+		self.pending = []
+		# rows of [x, y, prev_y, vel, accel, dir, layer, owner, dead]
+		self.missiles = []
+		
+	def __len__(self): return len(self.missiles)
+		
+	def spawn(self, owner, velocity=0.5, acceleration=1.1, direction=-1, pos=None):
+		width, height = self.sizes[direction]
+		if pos is None: pos = (owner.x+(owner.width-width)/2, owner.y - height/2 if direction == -1 else owner.y + owner.height)
+		self.pending.append((pos[0], pos[1], velocity, acceleration, direction, self.layers.index(owner.missile_layer), owner))
+		self.game.sounds.play('missile')
+		
+	def begin_step(self):
+		missiles = [m for m in self.missiles if not m[8]]
+		for x, y, vel, accel, direction, layer, owner in self.pending: missiles.append([x, y, y, vel, accel, direction, layer, owner, False])
+		for m in missiles: m[2] = m[1]
+		self.missiles = missiles
+		self.pending = []
+		
+	def update(self, ticks):
+		missiles = self.missiles
+		height = self.game.height
+		for m in missiles:
+			m[1] += m[5] * m[3]
+			m[3] *= m[4]
+			if (m[5] == -1 and m[1] < 0) or (m[5] == 1 and m[1] > height): m[8] = True
+			
+		# missiles bucketed into columns by x, a missile can only be inside the
+		# boxes of those in its own column or the one to its left
+		columns = dict((layer, {}) for layer in self.layers)
+		for j, t in enumerate(missiles): columns[self.layers[t[6]]].setdefault(int(t[0] // self.column_width), []).append((j, t))
+		
+		hits = []
+		for i, m in enumerate(missiles):
+			x, y, mask = m[0], m[1], self.masks[m[5]]
+			for layer in COLLISION_LAYERS[self.layers[m[6]]]:
+				if layer in columns:
+					column = int(x // self.column_width)
+					for j, t in sorted(columns[layer].get(column-1, []) + columns[layer].get(column, [])):
+						width, height = self.sizes[t[5]]
+						if self.overlaps(x, y, mask, t[0], t[1], width, height, self.masks[t[5]]): hits.append((i, j))
+				else:
+					for object in self.game.layers[layer]:
+						if self.overlaps(x, y, mask, object.x, object.y, object.width, object.height, object.hit_mask): hits.append((i, object))
+		self.resolve(hits)
+		
+	@staticmethod
+	def overlaps(x, y, mask, tx, ty, width, height, target_mask):
+		# Object.collides_with, for a missile at x, y
+		if not (x >= tx and x <= tx+width and y >= ty and y <= ty+height): return False
+		if target_mask is None: return True
+		return target_mask.overlap(mask, (int(x - tx), int(y - ty))) is not None
+		
+	def resolve(self, hits):
+		game = self.game
+		for i, target in hits:
+			missile = self.hitter(i)
+			self.kill(i)
+			game.add_object(Explosion.spawn(game, (missile.x+missile.width/2, missile.y+missile.height/2), 5))
+			if isinstance(target, Object): target.hit(missile)
+			else:
+				# shooting down a missile scores, whichever side fired it
+				self.kill(target)
+				game.score += 50
+				
+	def kill(self, i): self.missiles[i][8] = True
+	
+	def hitter(self, i):
+		m = self.missiles[i]
+		return Missile((m[0], m[1]), self.sizes[m[5]], m[7], self.layers[m[6]], m[5], self.masks[m[5]])
+		
+	def at_point(self, layer, x, y):
+		# missiles whose box holds the point; the caller does the narrowphase
+		layer = self.layers.index(layer)
+		found = []
+		for i, m in enumerate(self.missiles):
+			if m[6] != layer: continue
+			width, height = self.sizes[m[5]]
+			if x >= m[0] and x <= m[0]+width and y >= m[1] and y <= m[1]+height: found.append(self.hitter(i))
+		return found
+		
+	def boxes(self, layer):
+		layer = self.layers.index(layer)
+		for m in self.missiles:
+			if m[6] == layer: yield (m[0], m[1]) + self.sizes[m[5]]
+			
+	def positions(self): return [(m[0], m[1], m[5]) for m in self.missiles if not m[8]]
+			
+	def render(self, surface, alpha=1.0):
+		frames = self.frames
+		blits = [(frames[m[5]][0], (m[0], m[2] + (m[1] - m[2]) * alpha), frames[m[5]][1]) for m in self.missiles]
+		if hasattr(surface, 'blits'): return surface.blits(blits)
+		return [surface.blit(*blit) for blit in blits]
+
+class ArrayProjectiles(Projectiles):
+	
+	# Projectiles with one numpy array per column: missiles move, leave the
+	# screen and find their hit candidates in a few bulk operations, only the
+	# candidates go through the python narrowphase
+	
+	def clear(self):
+		self.pending = []
+		self.x = numpy.zeros(0)
+		self.y = numpy.zeros(0)
+		self.prev_y = numpy.zeros(0)
+		self.vel = numpy.zeros(0)
+		self.accel = numpy.zeros(0)
+		self.dir = numpy.zeros(0, dtype=int)
+		self.layer = numpy.zeros(0, dtype=int)
+		self.owner = numpy.zeros(0, dtype=object)
+		self.dead = numpy.zeros(0, dtype=bool)
+		
+	def __len__(self): return len(self.x)
+	
+	columns = ('x', 'y', 'vel', 'accel', 'dir', 'layer', 'owner')
+	
+	def begin_step(self):
+		keep = ~self.dead
+		new = zip(*self.pending) if self.pending else [()] * len(self.columns)
+		for name, values in zip(self.columns, new):
+			column = getattr(self, name)
+			added = numpy.empty(len(values), dtype=column.dtype)
+			added[:] = values
+			setattr(self, name, numpy.concatenate((column[keep], added)))
+		self.prev_y = self.y.copy()
+		self.dead = numpy.zeros(len(self.x), dtype=bool)
+		self.pending = []
+		
+	def box_sizes(self, which=slice(None)):
+		(uw, uh), (dw, dh) = self.sizes[-1], self.sizes[1]
+		up = self.dir[which] == -1
+		return numpy.where(up, uw, dw), numpy.where(up, uh, dh)
+		
+	def update(self, ticks):
+		if not len(self.x): return
+		self.y += self.dir * self.vel
+		self.vel *= self.accel
+		self.dead |= ((self.dir == -1) & (self.y < 0)) | ((self.dir == 1) & (self.y > self.game.height))
+		
+		# broadphase: every missile against every target box of the layers it
+		# can hit, as one comparison per layer. candidates are then sorted into
+		# the order the per-missile loop in Projectiles would find them
+		candidates = []
+		for layer_index, name in enumerate(self.layers):
+			mine = numpy.flatnonzero(self.layer == layer_index)
+			if not len(mine): continue
+			x = self.x[mine][:,None]
+			y = self.y[mine][:,None]
+			
+			for order, layer in enumerate(COLLISION_LAYERS[name]):
+				if layer in self.layers:
+					targets = numpy.flatnonzero(self.layer == self.layers.index(layer))
+					if not len(targets): continue
+					tx, ty = self.x[targets], self.y[targets]
+					tw, th = self.box_sizes(targets)
+				else:
+					targets = list(self.game.layers[layer])
+					if not targets: continue
+					tx = numpy.array([t.x for t in targets], dtype=float)
+					ty = numpy.array([t.y for t in targets], dtype=float)
+					tw = numpy.array([t.width for t in targets], dtype=float)
+					th = numpy.array([t.height for t in targets], dtype=float)
 					
-					pygame.display.flip()
-					self.screen.fill((0,0,0))
+				inside = (x >= tx) & (x <= tx + tw) & (y >= ty) & (y <= ty + th)
+				for a, b in zip(*numpy.nonzero(inside)): candidates.append((mine[a], order, b, targets[b]))
+		
+		candidates.sort(key=lambda c: c[:3])
+		hits = []
+		for i, order, b, target in candidates:
+			x, y, mask = float(self.x[i]), float(self.y[i]), self.masks[self.dir[i]]
+			if isinstance(target, Object): tx, ty, target_mask = target.x, target.y, target.hit_mask
+			else: tx, ty, target_mask = float(self.x[target]), float(self.y[target]), self.masks[self.dir[target]]
+			if target_mask is None or target_mask.overlap(mask, (int(x - tx), int(y - ty))) is not None: hits.append((i, target))
+		self.resolve(hits)
+		
+	def kill(self, i): self.dead[i] = True
+	
+	def hitter(self, i):
+		direction = int(self.dir[i])
+		return Missile((float(self.x[i]), float(self.y[i])), self.sizes[direction], self.owner[i], self.layers[self.layer[i]], direction, self.masks[direction])
+		
+	def at_point(self, layer, x, y):
+		width, height = self.box_sizes()
+		inside = (self.layer == self.layers.index(layer)) & (x >= self.x) & (x <= self.x + width) & (y >= self.y) & (y <= self.y + height)
+		return [self.hitter(i) for i in numpy.flatnonzero(inside)]
+		
+	def boxes(self, layer):
+		which = numpy.flatnonzero(self.layer == self.layers.index(layer))
+		width, height = self.box_sizes(which)
+		return zip(self.x[which].tolist(), self.y[which].tolist(), width.tolist(), height.tolist())
+		
+	def positions(self):
+		live = ~self.dead
+		return zip(self.x[live].tolist(), self.y[live].tolist(), self.dir[live].tolist())
+		
+	def render(self, surface, alpha=1.0):
+		ys = (self.prev_y + (self.y - self.prev_y) * alpha).tolist()
+		# look the frames up by direction in bulk; filled in one by one, as
+		# numpy would unpack the rects
+		sheets, rects = numpy.empty(2, dtype=object), numpy.empty(2, dtype=object)
+		for i, direction in enumerate((-1, 1)): sheets[i], rects[i] = self.frames[direction]
+		index = (self.dir > 0).astype(int)
+		blits = zip(sheets[index].tolist(), zip(self.x.tolist(), ys), rects[index].tolist())
+		if hasattr(surface, 'blits'): return surface.blits(blits)
+		return [surface.blit(*blit) for blit in blits]
+
+class Display(object):
+	
+	# the window and the canvas frames are drawn on. the canvas is RESOLUTION
+	# scaled by render_scale; SDL's SCALED mode stretches it to the monitor on
+	# the GPU, without one we scale-blit into a native size window ourselves
+	
+	def __init__(self, render_scale=RENDER_SCALE, fullscreen=True):
+		self.scale = render_scale
+		size = (int(RESOLUTION[0] * render_scale), int(RESOLUTION[1] * render_scale))
+		
+		self.window = self.canvas = None
+		if not fullscreen: self.window = self.canvas = pygame.display.set_mode(size)
+		elif hasattr(pygame, 'SCALED'): self.window = self.canvas = self.open_scaled(size)
+		
+		if self.window is None:
+			pygame.display.init()
+			if hasattr(pygame.display, 'get_desktop_sizes'): native = pygame.display.get_desktop_sizes()[0]
+			else: native = pygame.display.Info().current_w, pygame.display.Info().current_h
+			self.window = pygame.display.set_mode(native, FULLSCREEN)
+			self.canvas = pygame.Surface(size).convert()
 			
-				self.high_score_table.save_high_scores()
+			# letterbox to keep the aspect ratio
+			ww, wh = self.window.get_size()
+			fit = min(float(ww) / size[0], float(wh) / size[1])
+			target = pygame.Rect(0, 0, int(size[0] * fit), int(size[1] * fit))
+			target.center = (ww/2, wh/2)
+			self.target = self.window.subsurface(target)
+			
+		self.view = self.canvas if render_scale == 1 else View(self.canvas, render_scale)
+		
+	@staticmethod
+	def open_scaled(size):
+		# without an accelerated renderer pygame warns and scales in software,
+		# which is slower than doing it ourselves
+		with warnings.catch_warnings(record=True) as caught:
+			warnings.simplefilter('always')
+			window = pygame.display.set_mode(size, FULLSCREEN | pygame.SCALED)
+		if any('renderer' in str(w.message) for w in caught): return None
+		return window
+		
+	def to_canvas(self, rect):
+		if self.scale == 1: return rect
+		return self.view.to_canvas(rect)
+		
+	def present(self, rects=None):
+		if self.window is not self.canvas:
+			pygame.transform.scale(self.canvas, self.target.get_size(), self.target)
+			pygame.display.flip()
+		elif rects is None: pygame.display.flip()
+		else: pygame.display.update(rects)
+
+class View(object):
+	
+	# draws onto a canvas of a different size using logical coordinates;
+	# each source image is scaled once and kept while the image is alive
+	
+	def __init__(self, canvas, scale):
+		self.canvas = canvas
+		self.scale = scale
+		self.images = weakref.WeakKeyDictionary()
+		
+	def get_size(self): return RESOLUTION
+	def get_width(self): return RESOLUTION[0]
+	def get_height(self): return RESOLUTION[1]
+	
+	def to_canvas(self, rect):
+		x, y, w, h = rect
+		s = self.scale
+		return pygame.Rect(int(x*s), int(y*s), int(math.ceil(w*s)), int(math.ceil(h*s)))
+	
+	def image(self, image):
+		scaled = self.images.get(image)
+		if scaled is None:
+			w, h = image.get_size()
+			scaled = self.images[image] = pygame.transform.scale(image, (max(1, int(w*self.scale)), max(1, int(h*self.scale))))
+		# callers fade images by changing their alpha between blits
+		alpha = image.get_alpha()
+		if alpha != scaled.get_alpha(): scaled.set_alpha(alpha)
+		return scaled
+		
+	def blit(self, image, (x, y), area=None, special_flags=0):
+		if area is not None: area = self.to_canvas(area)
+		return self.canvas.blit(self.image(image), (int(x*self.scale), int(y*self.scale)), area, special_flags)
+		
+	def fill(self, color, rect=None):
+		return self.canvas.fill(color, None if rect is None else self.to_canvas(rect))
+
+class DirtyRenderer(object):
+	
+	# presents only the parts of the screen that changed: everything drawn
+	# this frame is marked on a coarse tile grid, the union with last frame's
+	# tiles is pushed with display.update and the drawn tiles are cleared
+	# back to black, ready for the next frame
+	
+	def __init__(self, display, tile_size=32):
+		self.display = display
+		self.screen = display.canvas
+		self.tile_size = tile_size
+		self.tiles = set()
+		self.previous_tiles = set()
+		self.full_update = True
+		
+	def invalidate(self):
+		self.screen.fill((0,0,0))
+		self.tiles = set()
+		self.previous_tiles = set()
+		self.full_update = True
+		
+	def add_rect(self, rect):
+		if rect is None: return
+		x, y, w, h = rect
+		if w <= 0 or h <= 0: return
+		ts = self.tile_size
+		for tx in xrange(int(x // ts), int((x+w-1) // ts)+1):
+			for ty in xrange(int(y // ts), int((y+h-1) // ts)+1):
+				self.tiles.add((tx, ty))
 				
-		pygame.mouse.set_visible(True)
+	def tile_rects(self, tiles):
+		# merge horizontal runs of tiles into single rects
+		ts = self.tile_size
+		rects = []
+		run = None
+		for tx, ty in sorted(tiles, key=lambda t: (t[1], t[0])):
+			if run and run[1] == ty and run[0] + run[2] == tx: run[2] += 1
+			else:
+				if run: rects.append(pygame.Rect(run[0]*ts, run[1]*ts, run[2]*ts, ts))
+				run = [tx, ty, 1]
+		if run: rects.append(pygame.Rect(run[0]*ts, run[1]*ts, run[2]*ts, ts))
+		return rects
+		
+	def present(self):
+		drawn = self.tile_rects(self.tiles)
+		
+		if self.full_update:
+			self.display.present()
+			self.full_update = False
+		else:
+			self.display.present(self.tile_rects(self.tiles | self.previous_tiles))
+			
+		for rect in drawn: self.screen.fill((0,0,0), rect)
+		self.previous_tiles = self.tiles
+		self.tiles = set()
+
+class ExplosionFrames(object):
+	
+	# a stage of an explosion is a ring of dots whose pattern doesn't depend on
+	# the growing radius, so each (magnitude, stage) pattern is made once in a
+	# few random variants and its pre-rendered dots are blitted straight onto
+	# the view at the current radius
+	
+	def __init__(self, rng=random, variants=3):
+		self.rng = rng
+		self.variants = variants
+		self.patterns = {}
+		self.dots = {}
+		
+	def get(self, max_stages, stage):
+		key = (max_stages, stage, self.rng.randrange(self.variants))
+		pattern = self.patterns.get(key)
+		if pattern is None: pattern = self.patterns[key] = self.make_pattern(max_stages, stage)
+		return pattern
+		
+	def make_pattern(self, max_stages, stage):
+		# (cos, sin, dot, offset of the dot's centre) per dot
+		c = (max(0, 255-stage*(255/max_stages)),0,0)
+		pattern = []
+		for i in range(self.rng.randint(6, max(10, 6*stage))):
+			sz = self.rng.randint(1,3)
+			pattern.append((math.cos(i), math.sin(i), self.dot(c, sz), 0 if sz == 1 else sz))
+		return pattern
+		
+	def dot(self, color, sz):
+		surf = self.dots.get((color, sz))
+		if surf is None:
+			if sz == 1:
+				surf = pygame.Surface((1, 1)).convert()
+				surf.fill(color)
+			else:
+				surf = pygame.Surface((sz*2+1, sz*2+1)).convert_alpha()
+				surf.fill((0,0,0,0))
+				pygame.draw.circle(surf, color, (sz, sz), sz)
+			self.dots[(color, sz)] = surf
+		return surf
+		
+	def draw(self, surface, max_stages, stage, (x, y), radius):
+		x, y = int(x-radius), int(y-radius)
+		blits = [(dot, (x + int(radius*cos + radius) - offset, y + int(radius*sin + radius) - offset)) for cos, sin, dot, offset in self.get(max_stages, stage)]
+		if hasattr(surface, 'blits'): rects = surface.blits(blits)
+		else: rects = [surface.blit(*blit) for blit in blits]
+		return rects[0].unionall(rects[1:])
+
+class TextCache(object):
+	
+	def __init__(self, max_entries=256):
+		self.max_entries = max_entries
+		self.entries = collections.OrderedDict()
+		
+	def render(self, font, text, color):
+		key = (font, text, color)
+		surf = self.entries.pop(key, None)
+		
+		if surf is None:
+			surf = font.render(text, True, color)
+			if len(self.entries) >= self.max_entries: self.entries.popitem(last=False)
+			
+		self.entries[key] = surf
+		return surf
+
+class GlyphAtlas(object):
+	
+	# one surface holding a pre-rendered strip of glyphs, used for the
+	# numbers that change every frame (score, fps)
+	
+	def __init__(self, font, color, chars="0123456789"):
+		glyphs = [(c, font.render(c, True, color)) for c in chars]
+		self.surface = pygame.Surface((sum(g.get_width() for c, g in glyphs), font.get_height()), SRCALPHA)
+		self.surface.fill((0,0,0,0))
+		self.rects = {}
+		
+		x = 0
+		for c, g in glyphs:
+			self.surface.blit(g, (x, 0), None, BLEND_RGBA_ADD)
+			self.rects[c] = pygame.Rect(x, 0, g.get_width(), g.get_height())
+			x += g.get_width()
+			
+	def get_width(self, text): return sum(self.rects[c].width for c in text)
+	
+	def render(self, surface, text, pos):
+		x, y = pos
+		for c in text:
+			rect = self.rects[c]
+			surface.blit(self.surface, (x, y), rect)
+			x += rect.width
+		return x
 
 class Starfield(object):
 	
 	class Star(object):
 		
-		def __init__(self): self.randomize()			
+		def __init__(self, rng=random): 
+			self.rng = rng
+			self.randomize()
+			self.prev_y = self.y
 			
 		def randomize(self):
-			self.x = random.randint(0, RESOLUTION[0])
-			self.y = random.randint(0, RESOLUTION[1])
-			self.accel = 1.0 + random.random()/32
+			self.x = self.rng.randint(0, RESOLUTION[0])
+			self.y = self.rng.randint(0, RESOLUTION[1])
+			self.accel = 1.0 + self.rng.random()/32
 			self.length = int(self.accel * 200)
-			self.vel = random.random()
-			self.color = random.randint(50, 200)
-			self.size = random.randint(1,3)
+			self.vel = self.rng.random()
+			self.color = self.rng.randint(50, 200)
+			self.size = self.rng.randint(1,3)
 		
-		def render(self, surface):
+		def render(self, surface, scale=1.0):
+			x, y = int(self.x*scale), int(self.y*scale)
 			if self.size == 1: 
-				surface.set_at((int(self.x), int(self.y)), (self.color, self.color, self.color))
+				surface.set_at((x, y), (self.color, self.color, self.color))
 			elif self.size == 2: 
-				pygame.draw.rect(surface, (self.color,self.color,self.color), (int(self.x), int(self.y), self.size, self.size))
+				pygame.draw.rect(surface, (self.color,self.color,self.color), (x, y, self.size, self.size))
 			elif self.size == 3:
-				pygame.draw.circle(surface, (self.color,self.color,self.color), (int(self.x), int(self.y)), self.size)
+				pygame.draw.circle(surface, (self.color,self.color,self.color), (x, y), self.size)
 			
 		def update(self, ticks):
+			self.prev_y = self.y
 			self.y += self.vel
 			self.vel *= self.accel
 			
 			if self.y > RESOLUTION[1]:
 				self.randomize()
-				self.y = 0
+				self.y = self.prev_y = 0
 				
-	def __init__(self, num_stars=100):
+	def __init__(self, num_stars=NUM_STARS, rng=random, scale=1.0):
 		self.num_stars = num_stars
 		self.width, self.height = RESOLUTION
+		self.scale = scale
 		self.stars = []
 		
 		for i in range(num_stars):
-			s = self.Star()
+			s = self.Star(rng)
 			self.stars.append(s)
 			
 	def update(self, ticks):
 		for s in self.stars: s.update(ticks)
 		
-	def render(self, surface):
-		for s in self.stars: s.render(surface)	
+	def render(self, surface, alpha=1.0):
+		for s in self.stars: 
+			y = s.y
+			s.y = s.prev_y + (y - s.prev_y) * alpha
+			s.render(surface, self.scale)
+			s.y = y
+		
+	def mark_dirty(self, dirty):
+		k = self.scale
+		for s in self.stars: dirty.add_rect((int(s.x*k)-s.size, int(s.prev_y*k)-s.size, 2*s.size+1, int((s.y-s.prev_y)*k)+2*s.size+2))
+
+class ArrayStarfield(object):
+	
+	# same behaviour as Starfield, but every star attribute lives in a numpy
+	# array so updates, respawns and drawing are a handful of bulk operations
+	
+	def __init__(self, num_stars=NUM_STARS, rng=random, scale=1.0):
+		self.num_stars = num_stars
+		self.width, self.height = RESOLUTION
+		self.scale = scale
+		self.rng = numpy.random.RandomState(rng.getrandbits(32))
+		
+		self.x = numpy.zeros(num_stars)
+		self.y = numpy.zeros(num_stars)
+		self.accel = numpy.ones(num_stars)
+		self.vel = numpy.zeros(num_stars)
+		self.color = numpy.zeros(num_stars, dtype=int)
+		self.size = numpy.ones(num_stars, dtype=int)
+		self.randomize(numpy.ones(num_stars, dtype=bool))
+		self.prev_y = self.y.copy()
+		self.drawn_y = self.y
+		
+		self.stencils = dict((size, self.make_stencil(size)) for size in (1,2,3))
+		self.color_lut = None
+		self.color_lut_format = None
+		
+	@staticmethod
+	def make_stencil(size):
+		# pixel offsets matching set_at, draw.rect and draw.circle in Starfield.Star.render
+		if size == 1: points = [(0,0)]
+		elif size == 2: points = [(dx,dy) for dx in range(2) for dy in range(2)]
+		else: points = [(dx,dy) for dx in range(-size,size+1) for dy in range(-size,size+1) if dx*dx+dy*dy <= size*size]
+		return numpy.array([p[0] for p in points]), numpy.array([p[1] for p in points])
+		
+	def randomize(self, which):
+		n = int(which.sum())
+		self.x[which] = self.rng.randint(0, self.width+1, n)
+		self.y[which] = self.rng.randint(0, self.height+1, n)
+		self.accel[which] = 1.0 + self.rng.random_sample(n)/32
+		self.vel[which] = self.rng.random_sample(n)
+		self.color[which] = self.rng.randint(50, 201, n)
+		self.size[which] = self.rng.randint(1, 4, n)
+		
+	def update(self, ticks):
+		self.prev_y[:] = self.y
+		self.y += self.vel
+		self.vel *= self.accel
+		
+		off_screen = self.y > self.height
+		if off_screen.any():
+			self.randomize(off_screen)
+			self.y[off_screen] = 0
+			self.prev_y[off_screen] = 0
+			
+	def get_color_lut(self, surface):
+		format = (surface.get_bitsize(), surface.get_masks())
+		if format != self.color_lut_format:
+			self.color_lut = numpy.array([surface.map_rgb((c,c,c)) for c in range(256)], dtype=numpy.uint32)
+			self.color_lut_format = format
+		return self.color_lut
+		
+	def render(self, surface, alpha=1.0):
+		lut = self.get_color_lut(surface)
+		sw, sh = surface.get_size()
+		self.drawn_y = self.prev_y + (self.y - self.prev_y) * alpha
+		xs = (self.x * self.scale).astype(int)
+		ys = (self.drawn_y * self.scale).astype(int)
+		
+		pixels = pygame.surfarray.pixels2d(surface)
+		for size, (dx, dy) in self.stencils.items():
+			which = self.size == size
+			if not which.any(): continue
+			px = (xs[which][:,None] + dx).ravel()
+			py = (ys[which][:,None] + dy).ravel()
+			colors = numpy.repeat(lut[self.color[which]], len(dx))
+			visible = (px >= 0) & (px < sw) & (py >= 0) & (py < sh)
+			pixels[px[visible], py[visible]] = colors[visible]
+		del pixels
+		
+	def mark_dirty(self, dirty):
+		ts = dirty.tile_size
+		x = self.x * self.scale
+		y = self.drawn_y * self.scale
+		x0 = numpy.maximum(0, (x - self.size) // ts).astype(int)
+		y0 = numpy.maximum(0, (y - self.size) // ts).astype(int)
+		x1 = numpy.maximum(0, (x + self.size) // ts).astype(int)
+		y1 = numpy.maximum(0, (y + self.size) // ts).astype(int)
+		
+		# a star spans at most a 2x2 block of tiles
+		tx = numpy.concatenate((x0, x1, x0, x1))
+		ty = numpy.concatenate((y0, y0, y1, y1))
+		keys = numpy.unique(tx * 65536 + ty)
+		dirty.tiles.update(zip((keys // 65536).tolist(), (keys % 65536).tolist()))
+
+def atomic_write(path, lines):
+	# write to a temporary file next to the target, then rename it over the
+	# target so a crash leaves either the old or the new file, never half of one
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-')
+	f = os.fdopen(fd, 'w')
+	try:
+		f.writelines(lines)
+		f.flush()
+		os.fsync(f.fileno())
+	finally: f.close()
+	
+	try: os.rename(tmp, path)
+	except OSError:
+		# windows refuses to rename over an existing file
+		os.remove(path)
+		os.rename(tmp, path)
 
 class HighScoreTable(object):
 	
+	# every score ever stored is appended to the high score file as
+	# "score,timestamp,name" (older files hold plain "score,name" lines) and
+	# fed into bounded, sorted boards: one all-time and one per day. once the
+	# file grows past compact_after lines it is rewritten, atomically, with
+	# only the entries that still appear on a board
+	
+	ALL_TIME = 'all'
+	
 	class Entry(object):
 		
-		def __init__(self, _score, _name):
+		def __init__(self, _score, _name, _timestamp=None, _seq=0):
 			self.name = str(_name); self.score = int(_score)
+			self.timestamp = _timestamp; self.seq = _seq
+			
+		def line(self):
+			if self.timestamp is None: return "%s,%s\n" % (self.score, self.name)
+			return "%s,%d,%s\n" % (self.score, self.timestamp, self.name)
+			
+	class Board(object):
+		
+		def __init__(self, size=10):
+			self.size = size
+			self.keys = []
+			self.entries = []
 			
-		def __cmp__(self, obj):
-			try: cmp = 0 if obj.score == self.score else -1 if obj.score > self.score else 1
-			except Exception: return 0
-			return cmp
+		def qualifies(self, score):
+			return len(self.entries) < self.size or score > self.entries[-1].score
+			
+		def insert(self, entry):
+			if not self.qualifies(entry.score): return False
+			
+			# highest score first, earlier entries win ties
+			key = (-entry.score, entry.seq)
+			i = bisect.bisect_right(self.keys, key)
+			self.keys.insert(i, key)
+			self.entries.insert(i, entry)
+			if len(self.entries) > self.size:
+				self.keys.pop()
+				self.entries.pop()
+			return True
 	
-	def __init__(self, high_score_file="resources/highscores.txt"):
+	def __init__(self, high_score_file="resources/highscores.txt", size=10, compact_after=10000):
 		self.high_score_file = high_score_file
-		self.high_scores = self.load_high_scores()
-		self.score_font = pygame.font.Font('resources/century.ttf', 30)
+		self.size = size
+		self.compact_after = compact_after
+		self.boards = {}
+		self.seq = 0
+		self.log_lines = 0
+		self.shown_board = self.ALL_TIME
+		self.composed = {}
+		self.load_high_scores()
+		self.score_font = assets.font('resources/century.ttf', 30)
 		self.new_scores = False
 		
+	def get_high_scores(self): return self.board(self.ALL_TIME).entries
+	high_scores = property(get_high_scores, None, None, "All-time high scores, best first")
+	
+	day_cache = {}
+	
+	@classmethod
+	def day(cls, timestamp):
+		# every time zone offset is a multiple of 15 minutes, so a quarter
+		# hour never straddles two local days
+		quarter = int(timestamp) // 900
+		day = cls.day_cache.get(quarter)
+		if day is None: day = cls.day_cache[quarter] = time.strftime('%Y-%m-%d', time.localtime(quarter * 900))
+		return day
+	
+	def board(self, name):
+		board = self.boards.get(name)
+		if board is None: board = self.boards[name] = self.Board(self.size)
+		return board
+		
+	def add_entry(self, entry):
+		self.seq += 1
+		entry.seq = self.seq
+		self.composed.clear()
+		stored = self.board(self.ALL_TIME).insert(entry)
+		if entry.timestamp is not None: stored = self.board(self.day(entry.timestamp)).insert(entry) or stored
+		return stored
+		
 	def is_high_score(self, score):
-		return len(self.high_scores) < 10 or score > self.high_scores[-1].score
+		return self.board(self.ALL_TIME).qualifies(score) or self.board(self.day(time.time())).qualifies(score)
 		
 	def save_high_scores(self):
-		if self.new_scores:		
-			f = open(self.high_score_file, 'w')
-			for entry in self.high_scores: f.write("%s,%s\n" % (entry.score, entry.name))				
-			f.close()
+		if self.new_scores and self.log_lines > self.compact_after: self.compact()
+		self.new_scores = False
+		
+	def compact(self):
+		entries = {}
+		for board in self.boards.values():
+			for entry in board.entries: entries[entry.seq] = entry
+		atomic_write(self.high_score_file, [entries[seq].line() for seq in sorted(entries)])
+		self.log_lines = len(entries)
 		
 	def load_high_scores(self):
-		if not os.path.exists(self.high_score_file): return []
+		if not os.path.exists(self.high_score_file): return
 		
-		high_scores = []
+		all_time = self.board(self.ALL_TIME)
 		
 		f = open(self.high_score_file, 'r')
 		for line in f:
-			score, name = line.split(',')
-			high_scores.append(self.Entry(score.strip(), name.strip()))
+			# a last line without its newline is an append cut short by a crash
+			if not line.endswith('\n'): continue
+			parts = line.rstrip('\n').split(',', 2)
+			if len(parts) < 2 or not parts[0].strip(): continue
+			try:
+				score = int(parts[0])
+				timestamp = int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else None
+				day = None if timestamp is None else self.day(timestamp)
+			except (ValueError, OverflowError): continue
+			self.log_lines += 1
+			
+			if timestamp is not None:
+				# most historical scores make no board at all, skip building them
+				if not all_time.qualifies(score) and not self.board(day).qualifies(score):
+					self.seq += 1
+					continue
+				entry = self.Entry(score, parts[2].strip(), timestamp)
+			else: entry = self.Entry(score, ','.join(parts[1:]).strip())
+			self.add_entry(entry)
 		f.close()
 		
-		high_scores.sort()
-		high_scores.reverse()
-		
-		return high_scores
+		if self.log_lines > self.compact_after: self.compact()
+		
+	def store_score(self, name, score, timestamp=None):
+		entry = self.Entry(score, name, int(time.time() if timestamp is None else timestamp))
+		self.add_entry(entry)
+		
+		f = open(self.high_score_file, 'a+')
+		f.seek(0, os.SEEK_END)
+		if f.tell():
+			# start a fresh line after a torn one, load_high_scores() skips it
+			f.seek(-1, os.SEEK_END)
+			torn = f.read(1) != '\n'
+			f.seek(0, os.SEEK_END)
+			if torn: f.write('\n')
+		f.write(entry.line())
+		f.flush()
+		os.fsync(f.fileno())
+		f.close()
 		
-	def store_score(self, name, score):		
-		self.high_scores.append(self.Entry(score, name))
-		self.new_scores = True		
-		self.high_scores.sort()
-		self.high_scores.reverse()
-		if len(self.high_scores) > 10: self.high_scores.pop()
+		self.log_lines += 1
+		self.new_scores = True
 		
-	def new_score_entry(self, surface, score):
+	def new_score_entry(self, surface, score, present=pygame.display.flip):
 		sw, sh = surface.get_size()
 		msg = self.score_font.render("Enter your name:", True, (255,255,255))
 		msg_x = (sw - msg.get_width()) / 2
@@ -743,12 +2364,24 @@ class HighScoreTable(object):
 		name = ""
 		
 		done = False
+		redraw = True
 		while not done:
-			surface.fill((0,0,0))
+			if redraw:
+				txt = self.score_font.render(name, True, (255,255,255))
+				txt_x = (sw - txt.get_width()) / 2
+				txt_y = msg_y + 40
+				
+				surface.fill((0,0,0))
+				surface.blit(msg, (msg_x, msg_y))
+				surface.blit(txt, (txt_x, txt_y))
+				
+				present()
+				redraw = False
 		
-			events = pygame.event.get()
-			for e in events:
-				if e.type == KEYDOWN:
+			for e in wait_events(IDLE_WAIT):
+				if e.type == VIDEOEXPOSE: redraw = True
+				elif e.type == KEYDOWN:
+					redraw = True
 					if e.key == K_RETURN: done = True
 					elif e.key == K_BACKSPACE: name = name[0:-1]
 					elif e.key == K_SPACE: name += " "
@@ -762,28 +2395,31 @@ class HighScoreTable(object):
 
 						name += tmpbuf
 			
-			txt = self.score_font.render(name, True, (255,255,255))
-			txt_x = (sw - txt.get_width()) / 2
-			txt_y = msg_y + 40
-			
-			surface.blit(msg, (msg_x, msg_y))
-			surface.blit(txt, (txt_x, txt_y))
-			
-			pygame.display.flip()
-			pygame.time.delay(50)
-			
 		self.store_score(name, score)
 			
+	def toggle_board(self):
+		self.shown_board = self.day(time.time()) if self.shown_board == self.ALL_TIME else self.ALL_TIME
+		
 	def render(self, surface):
+		# boards only change when a score is stored, so each is drawn once
+		key = (self.shown_board, surface.get_size())
+		composed = self.composed.get(key)
+		if composed is None:
+			composed = self.composed[key] = pygame.Surface(key[1])
+			self.compose(composed)
+		surface.blit(composed, (0,0))
 		
-		num_scores = len(self.high_scores)
+	def compose(self, surface):
+		
+		high_scores = self.board(self.shown_board).entries
+		num_scores = len(high_scores)
 		
 		if num_scores == 0:
 			nhs = self.score_font.render("No High Scores!", True, (255,255,255))
 			surface.blit(nhs, ((surface.get_width()-nhs.get_width())/2, (surface.get_height()-nhs.get_height())/2))
 			return
 		
-		title = self.score_font.render("High Scores", True, (255, 90, 0))
+		title = self.score_font.render("High Scores" if self.shown_board == self.ALL_TIME else "Today's High Scores", True, (255, 90, 0))
 		
 		total_height = num_scores * (self.score_font.get_height() + 10)
 		max_score_width = 0
@@ -791,8 +2427,8 @@ class HighScoreTable(object):
 		dy = (surface.get_height() - total_height) / 2
 		surface.blit(title, ( (surface.get_width()-title.get_width())/2, (dy - 40)))
 		
-		for i in xrange(len(self.high_scores)):
-			score = self.high_scores[i]
+		for i in xrange(len(high_scores)):
+			score = high_scores[i]
 			c = (255,255,255) if i == 0 else (100,100,100)
 
 			score_txt = self.score_font.render(str(score.score), True, c)
@@ -802,8 +2438,8 @@ class HighScoreTable(object):
 
 		dy = (surface.get_height() - total_height) / 2
 		
-		for i in xrange(len(self.high_scores)):
-			score = self.high_scores[i]
+		for i in xrange(len(high_scores)):
+			score = high_scores[i]
 			c = (255,255,255) if i == 0 else (100,100,100)
 
 			name_txt = self.score_font.render(score.name, True, c)
@@ -811,4 +2447,36 @@ class HighScoreTable(object):
 			dy += self.score_font.get_height() + 10
 
 			
-if __name__ == '__main__':	Game().run()
\ No newline at end of file
+if __name__ == '__main__':
+	import optparse
+	parser = optparse.OptionParser()
+	parser.add_option("--stars", type="int", default=NUM_STARS, help="number of background stars")
+	parser.add_option("--dirty-rects", action="store_true", default=False, help="only present the changed parts of the screen")
+	parser.add_option("--max-fps", type="int", default=MAX_FPS, help="frame rate cap, 0 for uncapped")
+	parser.add_option("--low-latency", action="store_true", default=LOW_LATENCY, help="wait for the frame cap before reading input, not after")
+	parser.add_option("--render-scale", type="float", default=RENDER_SCALE, help="internal render resolution relative to %dx%d, e.g. 0.5 on slow machines" % RESOLUTION)
+	parser.add_option("--profile-frames", type="int", default=PROFILE_FRAMES, help="frames captured by the F4 profiling hotkey")
+	parser.add_option("--headless", action="store_true", default=False, help="step the simulation without display or audio and report its speed")
+	parser.add_option("--frames", type="int", default=10000, help="number of simulation steps to run headless")
+	parser.add_option("--script", help="input script for headless runs (lines of 'frames key key...'), random input if omitted")
+	parser.add_option("--seed", type="int", help="random seed for headless runs")
+	parser.add_option("--record", help="record each game's input to this file")
+	parser.add_option("--replay", help="re-run a recorded game headless as fast as possible and check its outcome")
+	options, args = parser.parse_args()
+	
+	if options.replay:
+		recording = InputRecording.load(options.replay)
+		result = Game(options.stars, headless=True).replay(recording)
+		print("replayed %(steps)d steps in %(seconds).2fs (%(fps).1f steps/s): score %(score)d, lives %(lives)d" % result)
+		if not recording.matches(result):
+			print("MISMATCH: recorded %d steps, score %d, lives %d" % (recording.steps, recording.score, recording.lives))
+			sys.exit(1)
+	elif options.headless:
+		pilot = ScriptedPilot.load(options.script) if options.script else RandomPilot(options.seed)
+		report = Game(options.stars, headless=True).run_headless(options.frames, pilot, options.seed)
+		print("%(frames)d frames, %(games)d games in %(seconds).2fs: %(fps).1f simulated fps" % report)
+	else:
+		game = Game(options.stars, options.dirty_rects, options.max_fps, profile_frames=options.profile_frames, record_path=options.record, render_scale=options.render_scale, low_latency=options.low_latency)
+		game.run()
+		print("input to present: " + game.input_latency.summary())
+		print("startup: " + ", ".join("%s %.0fms" % (name, seconds * 1000.0) for name, seconds in sorted(game.startup.items())))
\ No newline at end of file
@@ -0,0 +1,126 @@
+import os, sys, csv, optparse, itertools, multiprocessing, timeit
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from mothership import Game, AutoPilot, BALANCE, SIM_STEP
+
+try: import numpy
+except ImportError: numpy = None
+
+# half an hour of play at 30 steps a second
+MAX_STEPS = 30 * 60 * 30
+
+COLUMNS = ['run', 'seed'] + sorted(BALANCE) + ['game_over', 'steps', 'survival_seconds', 'score', 'peak_objects', 'step_ms_mean', 'step_ms_p95', 'step_ms_max']
+
+# one game per worker process, reused for every run it is handed
+game = None
+
+def init_worker(num_stars):
+	global game
+	game = Game(num_stars, headless=True)
+
+def run_game((run, seed, balance, max_steps)):
+	game.balance = dict(BALANCE, **balance)
+	game.main_loop_done = False
+	game.setup_game(seed)
+	pilot = AutoPilot()
+
+	timer = timeit.default_timer
+	costs = []
+	peak_objects = 0
+	steps = 0
+	while steps < max_steps and not game.main_loop_done:
+		start = timer()
+		pilot(game, steps)
+		game.step(SIM_STEP)
+		costs.append(timer() - start)
+		peak_objects = max(peak_objects, len(game.objects) + len(game.projectiles))
+		steps += 1
+
+	costs.sort()
+	n = len(costs)
+	result = dict(game.balance)
+	result.update({
+		'run': run,
+		'seed': seed,
+		'game_over': int(game.main_loop_done),
+		'steps': steps,
+		'survival_seconds': steps * SIM_STEP / 1000.0,
+		'score': game.score,
+		'peak_objects': peak_objects,
+		'step_ms_mean': sum(costs) / n * 1000.0,
+		'step_ms_p95': costs[min(n-1, int(n * 0.95))] * 1000.0,
+		'step_ms_max': costs[-1] * 1000.0,
+	})
+	return result
+
+def parameter_sets(settings):
+	# every combination of the values given per parameter
+	names = sorted(settings)
+	for values in itertools.product(*[settings[name] for name in names]): yield dict(zip(names, values))
+
+def jobs(settings, runs, seed, max_steps):
+	run = 0
+	for balance in parameter_sets(settings):
+		for i in xrange(runs):
+			yield (run, seed + run, balance, max_steps)
+			run += 1
+
+def write_results(path, results):
+	results = sorted(results, key=lambda result: result['run'])
+	if path.endswith('.npz'):
+		if numpy is None: raise SystemExit("writing .npz results needs numpy")
+		numpy.savez(path, **dict((column, numpy.array([result[column] for result in results])) for column in COLUMNS))
+		return
+
+	f = open(path, 'wb')
+	writer = csv.writer(f)
+	writer.writerow(COLUMNS)
+	for result in results: writer.writerow([result[column] for column in COLUMNS])
+	f.close()
+
+def summarize(results):
+	groups = {}
+	for result in results: groups.setdefault(tuple(result[name] for name in sorted(BALANCE)), []).append(result)
+
+	for key, group in sorted(groups.items()):
+		changed = ["%s=%s" % (name, value) for name, value in zip(sorted(BALANCE), key) if value != BALANCE[name]]
+		n = float(len(group))
+		print("%-40s runs %4d  survival %7.1fs  score %8.1f  game over %3d%%  peak objects %4d" % (
+			" ".join(changed) or "defaults", n,
+			sum(r['survival_seconds'] for r in group) / n,
+			sum(r['score'] for r in group) / n,
+			100 * sum(r['game_over'] for r in group) / n,
+			max(r['peak_objects'] for r in group)))
+
+def parse_setting(option, opt, value, parser):
+	name, _, values = value.partition('=')
+	if name not in BALANCE: raise optparse.OptionValueError("unknown parameter %s, expected one of %s" % (name, ", ".join(sorted(BALANCE))))
+	try: parser.values.settings[name] = [float(v) if '.' in v else int(v) for v in values.split(',')]
+	except ValueError: raise optparse.OptionValueError("bad values for %s: %s" % (name, values))
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--runs", type="int", default=100, help="games per parameter set")
+	parser.add_option("--set", action="callback", callback=parse_setting, type="string", metavar="NAME=V1,V2,...", help="sweep a BALANCE parameter over these values; repeat to sweep several")
+	parser.add_option("--seed", type="int", default=0, help="seed of the first run, later runs count up from it")
+	parser.add_option("--max-steps", type="int", default=MAX_STEPS, help="stop games that survive this many simulation steps")
+	parser.add_option("--workers", type="int", default=multiprocessing.cpu_count(), help="worker processes")
+	parser.add_option("--stars", type="int", default=0, help="background stars simulated per game")
+	parser.add_option("--output", default="sweep.csv", help="results file, one column per metric (.csv, or .npz with numpy)")
+	parser.set_defaults(settings={})
+	options, args = parser.parse_args()
+
+	start = timeit.default_timer()
+	work = list(jobs(options.settings, options.runs, options.seed, options.max_steps))
+	pool = multiprocessing.Pool(options.workers, init_worker, (options.stars,))
+	# small chunks keep the workers evenly loaded, games vary a lot in length
+	results = list(pool.imap_unordered(run_game, work, chunksize=max(1, len(work) // (options.workers * 16))))
+	pool.close()
+	pool.join()
+	seconds = timeit.default_timer() - start
+
+	write_results(options.output, results)
+	summarize(results)
+	steps = sum(result['steps'] for result in results)
+	print("%d games, %d steps in %.1fs on %d workers: %.0f steps/s" % (len(results), steps, seconds, options.workers, steps / seconds))